@@ -0,0 +1,200 @@
+#!/usr/bin/python3
+"""
+n1mm_view database benchmark
+times every dataaccess function and the dashboard's load_data cycle against
+one or more databases, usually made by generate_contest_db.py, and writes the
+results as JSON so runs from different commits can be compared.
+the write tests run against a temporary copy, the database is not changed.
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import queue
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import config
+import dataaccess
+
+__author__ = 'Jeffrey B. Otterson, N1KDO'
+__copyright__ = 'Copyright 2016, 2017, 2019 Jeffrey B. Otterson'
+__license__ = 'Simplified BSD'
+
+WRITE_BATCH_SIZE = 20
+
+
+def timed(function, iterations, setup=None):
+    """
+    call function iterations times, return a dict of timing statistics in milliseconds.
+    setup is called before each call, and is not timed.
+    """
+    times = []
+    for _ in range(iterations):
+        if setup is not None:
+            setup()
+        t0 = time.perf_counter()
+        function()
+        times.append((time.perf_counter() - t0) * 1000)
+    return {'iterations': iterations,
+            'min_ms': round(min(times), 3),
+            'median_ms': round(statistics.median(times), 3),
+            'max_ms': round(max(times), 3)}
+
+
+def benchmark_reads(db, iterations):
+    results = {}
+    cursor = db.cursor()
+    last_qso_time, _ = dataaccess.get_last_qso(cursor)
+    for name, function in (
+            ('get_qso_log_version', lambda: dataaccess.get_qso_log_version(cursor)),
+            ('get_last_qso', lambda: dataaccess.get_last_qso(cursor)),
+            ('get_operators_by_qsos', lambda: dataaccess.get_operators_by_qsos(cursor)),
+            ('get_station_qsos', lambda: dataaccess.get_station_qsos(cursor)),
+            ('get_qsos_per_hour_per_operator', lambda: dataaccess.get_qsos_per_hour_per_operator(cursor,
+                                                                                                 last_qso_time)),
+            ('get_qso_band_modes', lambda: dataaccess.get_qso_band_modes(cursor)),
+            ('get_qsos_per_hour_per_band', lambda: dataaccess.get_qsos_per_hour_per_band(cursor)),
+            ('get_qsos_by_section', lambda: dataaccess.get_qsos_by_section(cursor)),
+            ('get_stats_snapshot', lambda: dataaccess.get_stats_snapshot(db))):
+        results[name] = timed(function, iterations)
+    cursor.close()
+
+    results['AggregateModel.update full'] = timed(lambda: dataaccess.AggregateModel().update(db),
+                                                  max(1, iterations // 10))
+    model = dataaccess.AggregateModel()
+    snapshot = model.update(db)
+    results['AggregateModel.update no change'] = timed(lambda: model.update(db), iterations)
+    results['AggregateModel.update_rates'] = timed(lambda: model.update_rates(snapshot), iterations)
+    return results
+
+
+def benchmark_writes(db, iterations):
+    """
+    time the collector's writes, and the dashboard catching up with them.
+    """
+    results = {}
+    cursor = db.cursor()
+    cursor.execute('SELECT MAX(timestamp) FROM qso_log;')
+    timestamp = (cursor.fetchone()[0] or int(time.time())) + 60
+    counter = [0]
+
+    def make_rows(count):
+        rows = []
+        for _ in range(count):
+            counter[0] += 1
+            rows.append((timestamp + counter[0], 'N4N', 4, 1, 1, 1, 1400000, 1400000, 'BM%d' % counter[0],
+                         '599', '599', '2A', 'GA', ''))
+        return rows
+
+    rows = []
+    results['record_contacts'] = timed(lambda: dataaccess.record_contacts(db, cursor, rows), iterations,
+                                       setup=lambda: rows.__setitem__(slice(None), make_rows(WRITE_BATCH_SIZE)))
+    results['replace_contact'] = timed(lambda: dataaccess.replace_contact(db, cursor, rows[0]), iterations,
+                                       setup=lambda: rows.__setitem__(slice(None), make_rows(1)))
+    results['delete_contact'] = timed(
+        lambda: dataaccess.delete_contact(db, cursor, time.gmtime(rows[0][0]), 1, rows[0][8]), iterations,
+        setup=lambda: (rows.__setitem__(slice(None), make_rows(1)), dataaccess.record_contacts(db, cursor, rows)))
+    results['prune_changes'] = timed(lambda: dataaccess.prune_changes(db, config.CHANGE_LOG_SIZE), iterations)
+
+    model = dataaccess.AggregateModel()
+    model.update(db)
+    results['AggregateModel.update %d new' % WRITE_BATCH_SIZE] = timed(
+        lambda: model.update(db), iterations,
+        setup=lambda: dataaccess.record_contacts(db, cursor, make_rows(WRITE_BATCH_SIZE)))
+    cursor.close()
+    return results
+
+
+def benchmark_load_data(filename, iterations, size):
+    """
+    time the dashboard's load_data cycle, reading the database and drawing the charts.
+    """
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = '1'  # keep stdout clean for the JSON
+    import chartengine
+    import dashboard
+    results = {}
+    q = queue.Queue()
+    engine = chartengine.ChartEngine()
+
+    def drain():
+        while not q.empty():
+            q.get_nowait()
+
+    results['load_data first'] = timed(
+        lambda: dashboard.load_data(size, q, None, dataaccess.AggregateModel(), engine, database=filename),
+        max(1, iterations // 10), setup=drain)
+    model = dataaccess.AggregateModel()
+    snapshot = dashboard.load_data(size, q, None, model, engine, database=filename)
+    results['load_data no change'] = timed(
+        lambda: dashboard.load_data(size, q, snapshot, model, engine, database=filename), iterations, setup=drain)
+    drain()
+    engine.shutdown()
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark the dataaccess functions')
+    parser.add_argument('databases', nargs='+', help='database files to benchmark')
+    parser.add_argument('--iterations', type=int, default=20, help='number of times to run each function')
+    parser.add_argument('--no-load-data', action='store_true', help="skip the dashboard's load_data cycle")
+    parser.add_argument('--size', default='1280x1024', help='chart size for load_data, as WIDTHxHEIGHT')
+    parser.add_argument('--output', help='write the JSON results to this file instead of stdout')
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+    size = tuple(int(n) for n in args.size.split('x'))
+
+    report = {'commit': git_commit(),
+              'time': time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime()),
+              'python': platform.python_version(),
+              'sqlite': sqlite3.sqlite_version,
+              'machine': platform.machine(),
+              'databases': []}
+    for database in args.databases:
+        with tempfile.TemporaryDirectory() as directory:
+            # work on a copy, so the write tests and any migrations do not change the original.
+            filename = os.path.join(directory, os.path.basename(database))
+            shutil.copyfile(database, filename)
+            db = dataaccess.open_database(filename)
+            cursor = db.cursor()
+            dataaccess.create_tables(db, cursor)
+            cursor.execute('SELECT COUNT(*) FROM qso_log;')
+            qsos = cursor.fetchone()[0]
+            cursor.close()
+            print('%s: %d QSOs' % (database, qsos), file=sys.stderr)
+
+            reader = dataaccess.open_database(filename, read_only=True)
+            results = benchmark_reads(reader, args.iterations)
+            reader.close()
+            if not args.no_load_data:
+                results.update(benchmark_load_data(filename, args.iterations, size))
+            results.update(benchmark_writes(db, args.iterations))
+            db.close()
+        report['databases'].append({'database': database, 'qsos': qsos, 'results': results})
+
+    text = json.dumps(report, indent=2)
+    if args.output is None:
+        print(text)
+    else:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+#!/usr/bin/python3
+"""
+n1mm_view chart rendering benchmark
+renders every chart the dashboard shows from a fixed data set, at each screen
+size, headless with the dummy SDL video driver.  for each chart it reports the
+wall and CPU time per render, the peak python memory of a render, the python
+memory still held after many renders, and the growth of the process's peak RSS.
+memory that keeps growing from one render to the next is a leak.
+"""
+
+import argparse
+import gc
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:  # windows
+    resource = None
+
+import config
+import constants
+import dataaccess
+
+__author__ = 'Jeffrey B. Otterson, N1KDO'
+__copyright__ = 'Copyright 2016, 2017, 2019 Jeffrey B. Otterson'
+__license__ = 'Simplified BSD'
+
+SIZES = [(1280, 1024), (1920, 1080)]
+
+
+def make_snapshot():
+    """
+    make the same StatsSnapshot every time: 20 operators, 6 stations, 24 hours of QSOs.
+    """
+    random.seed(1)
+    snapshot = dataaccess.StatsSnapshot()
+    snapshot.qso_operators = sorted([('OP%02d' % i, random.randint(100, 3000)) for i in range(1, 21)],
+                                    key=lambda operator_qsos: operator_qsos[1], reverse=True)
+    snapshot.qso_stations = [('STATION-%d' % i, random.randint(1000, 8000)) for i in range(1, 7)]
+    snapshot.qso_band_modes = [[random.randint(0, 3000) for _ in range(4)] if 1 <= band <= 7 else [0] * 4
+                               for band in range(constants.Bands.count())]
+    snapshot.operator_qso_rates = dataaccess.make_rates_table(
+        'Operator', [('OP%02d' % i, [random.randint(0, 200) for _ in config.RATE_WINDOW_MINUTES]) for i in range(1, 9)],
+        config.RATE_WINDOW_MINUTES)
+    start = 1561226400  # 2019-06-22 18:00:00
+    minutes = [(start + minute * 60, band, random.randint(0, 4)) for minute in range(24 * 60) for band in range(1, 8)]
+    snapshot.qsos_per_hour, snapshot.qsos_per_band = dataaccess.make_qsos_per_hour_per_band(
+        [row[0] for row in minutes], [row[1] for row in minutes], [row[2] for row in minutes])
+    snapshot.qsos_by_section = {section: random.randint(0, 400) for section in constants.CONTEST_SECTIONS}
+    return snapshot
+
+
+def make_charts(graphics, snapshot):
+    """
+    return (name, function of size) for every chart
+    """
+    return [
+        ('qso_summary_table', lambda size: graphics.qso_summary_table(size, snapshot.qso_band_modes)),
+        ('qso_rates_table', lambda size: graphics.qso_rates_table(size, snapshot.operator_qso_rates)),
+        ('qso_operators_graph', lambda size: graphics.qso_operators_graph(size, snapshot.qso_operators)),
+        ('qso_operators_table', lambda size: graphics.qso_operators_table(size, snapshot.qso_operators)),
+        ('qso_stations_graph', lambda size: graphics.qso_stations_graph(size, snapshot.qso_stations)),
+        ('qso_bands_graph', lambda size: graphics.qso_bands_graph(size, snapshot.qso_band_modes)),
+        ('qso_modes_graph', lambda size: graphics.qso_modes_graph(size, snapshot.qso_band_modes)),
+        ('qso_rates_chart', lambda size: graphics.qso_rates_chart(size, snapshot.qsos_per_hour)),
+        ('draw_map', lambda size: graphics.draw_map(size, snapshot.qsos_by_section)),
+    ]
+
+
+def max_rss_kb():
+    if resource is None:
+        return 0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == 'darwin' else rss  # bytes on macOS, KB elsewhere
+
+
+def benchmark_chart(render, size, iterations, memory_iterations):
+    """
+    time iterations renders, then trace the memory of memory_iterations more.
+    """
+    rss_before = max_rss_kb()
+    t0 = time.perf_counter()
+    render(size)
+    first = time.perf_counter() - t0
+
+    wall = []
+    cpu = []
+    for _ in range(iterations):
+        w0 = time.perf_counter()
+        c0 = time.process_time()
+        render(size)
+        cpu.append(time.process_time() - c0)
+        wall.append(time.perf_counter() - w0)
+
+    # tracing slows everything down, so memory is measured separately from time.
+    gc.collect()
+    tracemalloc.start()
+    peaks = []
+    held = []
+    for _ in range(memory_iterations):
+        if hasattr(tracemalloc, 'reset_peak'):  # python 3.9, before that the peak is over all the renders
+            tracemalloc.reset_peak()
+        render(size)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        gc.collect()
+        held.append(tracemalloc.get_traced_memory()[0])
+    tracemalloc.stop()
+
+    return {'iterations': iterations,
+            'first_ms': round(first * 1000, 1),
+            'wall_median_ms': round(statistics.median(wall) * 1000, 1),
+            'wall_max_ms': round(max(wall) * 1000, 1),
+            'cpu_median_ms': round(statistics.median(cpu) * 1000, 1),
+            'tracemalloc_peak_kb': max(peaks) // 1024,
+            'tracemalloc_growth_kb': (held[-1] - held[0]) // 1024,
+            'max_rss_growth_kb': max_rss_kb() - rss_before}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark the chart rendering')
+    parser.add_argument('--iterations', type=int, default=20, help='number of timed renders of each chart')
+    parser.add_argument('--memory-iterations', type=int, default=10,
+                        help='number of memory traced renders of each chart')
+    parser.add_argument('--chart', action='append', help='only benchmark this chart, may be repeated')
+    parser.add_argument('--output', help='also write the results as JSON to this file')
+    args = parser.parse_args()
+
+    # graphics needs pygame, and loads its font from the n1mm_view directory.
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = '1'
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    import graphics
+    logging.getLogger().setLevel(logging.WARNING)
+
+    charts = make_charts(graphics, make_snapshot())
+    if args.chart:
+        charts = [(name, render) for name, render in charts if name in args.chart]
+    results = []
+    print('%-20s %-10s %9s %9s %9s %9s %9s %9s' % ('chart', 'size', 'first ms', 'wall ms', 'cpu ms', 'peak KB',
+                                                   'growth KB', 'RSS+ KB'))
+    for size in SIZES:
+        for name, render in charts:
+            try:
+                result = benchmark_chart(render, size, args.iterations, args.memory_iterations)
+            except Exception as e:
+                logging.debug('%s failed', name, exc_info=True)
+                result = {'error': str(e)}
+            result.update({'chart': name, 'size': '%dx%d' % size})
+            results.append(result)
+            if 'error' in result:
+                print('%-20s %-10s failed: %s' % (name, result['size'], result['error']))
+            else:
+                print('%-20s %-10s %9.1f %9.1f %9.1f %9d %9d %9d' % (
+                    name, result['size'], result['first_ms'], result['wall_median_ms'], result['cpu_median_ms'],
+                    result['tracemalloc_peak_kb'], result['tracemalloc_growth_kb'], result['max_rss_growth_kb']))
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump({'time': time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime()), 'results': results}, f, indent=2)
+            f.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/python3
+"""
+n1mm_view message parser benchmark
+measures how many N1MM+ messages per second the collector can parse, using
+replayer-generated contactinfo payloads.  compares the original minidom code
+with the fast parser, and shows the cost of classifying a message by type.
+"""
+
+import argparse
+import random
+import time
+from xml.dom.minidom import parseString
+
+import collector
+import constants
+import replayer
+
+__author__ = 'Jeffrey B. Otterson, N1KDO'
+__copyright__ = 'Copyright 2016, 2017, 2019 Jeffrey B. Otterson'
+__license__ = 'Simplified BSD'
+
+CONTACT_FIELDS = ['timestamp', 'mycall', 'band', 'mode', 'operator', 'StationName', 'NetBiosName',
+                  'rxfreq', 'txfreq', 'call', 'snt', 'rcv', 'exchange1', 'section', 'comment']
+
+
+def make_payloads(count):
+    """
+    make some contactinfo messages that look like what the replayer sends.
+    """
+    bands = [('1.8', 180000), ('3.5', 350000), ('7', 700000), ('14', 1400000), ('21', 2100000), ('28', 2800000)]
+    modes = ['CW', 'USB', 'LSB', 'RTTY', 'FT8']
+    sections = list(constants.CONTEST_SECTIONS.keys())
+    payloads = []
+    for i in range(count):
+        band, freq = random.choice(bands)
+        call = 'W%d%s' % (random.randint(0, 9), ''.join(random.choice('ABCDEFGHIJKLMNOPQRSTUVWXYZ') for _ in range(3)))
+        values = ('2017-06-24 %02d:%02d:%02d' % (18 + i // 3600 % 6, i // 60 % 60, i % 60),
+                  band, freq, freq, 'N1KDO', random.choice(modes), call, 'K', 'W4', 'W4', 'NA',
+                  '599', '', '599', '', '', '2A', random.choice(sections), 5, 1, 'STATION-%d' % (i % 6))
+        payloads.append((replayer.TEMPLATE % values).encode())
+    return payloads
+
+
+def parse_minidom(data):
+    """
+    the way collector.process_message used to do it: parse a dom, search it for every field.
+    """
+    dom = parseString(data)
+    if dom.getElementsByTagName('contactinfo').length == 1:
+        fields = {}
+        for name in CONTACT_FIELDS:
+            try:
+                fc = dom.getElementsByTagName(name)[0].firstChild
+                fields[name] = '' if fc is None else fc.nodeValue
+            except IndexError:
+                fields[name] = ''
+        return 'contactinfo', fields
+    return None
+
+
+def run(name, parser, payloads, iterations):
+    best = None
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        for payload in payloads:
+            parser(payload)
+        elapsed = time.perf_counter() - t0
+        if best is None or elapsed < best:
+            best = elapsed
+    rate = len(payloads) / best
+    print('%-12s %10.0f messages/sec' % (name, rate))
+    return rate
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark the collector message parser')
+    parser.add_argument('--messages', type=int, default=5000, help='number of messages to parse per iteration')
+    parser.add_argument('--iterations', type=int, default=5, help='number of iterations, best is reported')
+    args = parser.parse_args()
+
+    random.seed(1)
+    payloads = make_payloads(args.messages)
+    for payload in payloads[:10]:
+        if parse_minidom(payload)[1]['call'] != collector.parse_message(payload)[1]['call']:
+            raise ValueError('parsers disagree!')
+
+    before = run('minidom', parse_minidom, payloads, args.iterations)
+    run('dom fallback', collector.parse_message_dom, payloads, args.iterations)
+    after = run('fast', collector.parse_message, payloads, args.iterations)
+    run('classify', collector.classify_message, payloads, args.iterations)
+    print('speedup: %.1fx' % (after / before))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+#!/usr/bin/python3
+"""
+n1mm_view QSO rate series benchmark
+measures how long it takes to read the QSOs per hour by band chart series from
+the qso_count_by_minute_band table, and how long it takes to build the series
+from the rows, comparing the original row walking code with the numpy version
+in dataaccess.
+"""
+
+import argparse
+import logging
+import random
+import sqlite3
+import time
+from collections import Counter
+from datetime import datetime
+
+import numpy as np
+
+import config
+import constants
+import dataaccess
+
+__author__ = 'Jeffrey B. Otterson, N1KDO'
+__copyright__ = 'Copyright 2016, 2017, 2019 Jeffrey B. Otterson'
+__license__ = 'Simplified BSD'
+
+
+def make_database(qsos, hours):
+    """
+    make an in-memory qso_count_by_minute_band table for some random QSOs.
+    the log has quiet periods, so the rate series has empty buckets to fill in.
+    """
+    start = 1498327200  # 2017-06-24 18:00:00
+    counts = Counter()
+    for _ in range(qsos):
+        timestamp = start + random.randint(0, hours * 3600 - 1)
+        if timestamp // 3600 % 6 == 5:
+            continue  # off the air
+        counts[(timestamp // 60 * 60, random.randint(1, constants.Bands.count() - 1))] += 1
+    db = sqlite3.connect(':memory:')
+    db.execute('CREATE TABLE qso_count_by_minute_band\n'
+               '    (minute INTEGER NOT NULL, band_id INTEGER NOT NULL, qso_count INTEGER NOT NULL,\n'
+               '     PRIMARY KEY (minute, band_id)) WITHOUT ROWID;')
+    db.executemany('INSERT INTO qso_count_by_minute_band VALUES (?, ?, ?);',
+                   [(minute, band_id, count) for (minute, band_id), count in counts.items()])
+    db.commit()
+    return db, len(counts)
+
+
+def query(cursor):
+    bucket_seconds = config.RATE_BUCKET_MINUTES * 60
+    cursor.execute('SELECT minute / %d * %d AS ts, band_id, SUM(qso_count) AS qso_count \n'
+                   'FROM qso_count_by_minute_band GROUP BY ts, band_id;' % (bucket_seconds, bucket_seconds))
+    return cursor.fetchall()
+
+
+def rates_legacy(rows):
+    """
+    the way it used to be done: gap fill in python, convert every bucket to a datetime, then
+    transpose into per band lists for the stackplot.
+    """
+    slice_minutes = config.RATE_BUCKET_MINUTES
+    slices_per_hour = 60 / slice_minutes
+    window_seconds = slice_minutes * 60
+    qsos_per_hour = []
+    qsos_by_band = [0] * constants.Bands.count()
+    for row in rows:
+        if len(qsos_per_hour) == 0:
+            qsos_per_hour.append([0] * constants.Bands.count())
+            qsos_per_hour[-1][0] = row[0]
+        while qsos_per_hour[-1][0] != row[0]:
+            ts = qsos_per_hour[-1][0] + window_seconds
+            qsos_per_hour.append([0] * constants.Bands.count())
+            qsos_per_hour[-1][0] = ts
+        qsos_per_hour[-1][row[1]] = row[2] * slices_per_hour
+        qsos_by_band[row[1]] += row[2]
+    for rec in qsos_per_hour:
+        rec[0] = datetime.utcfromtimestamp(rec[0])
+
+    qso_counts = [[] for _ in range(constants.Bands.count())]
+    for qpm in qsos_per_hour:
+        for i in range(0, constants.Bands.count()):
+            qso_counts[i].append(qpm[i])
+    return qso_counts, qsos_by_band
+
+
+def rates_numpy(rows):
+    rows = dataaccess.rows_to_array(rows, 3)
+    return dataaccess.make_qsos_per_hour_per_band(rows[:, 0], rows[:, 1], rows[:, 2])
+
+
+def run(name, function, argument, iterations):
+    best = None
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        function(argument)
+        elapsed = time.perf_counter() - t0
+        if best is None or elapsed < best:
+            best = elapsed
+    print('%-8s %10.3f ms' % (name, best * 1000))
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark the QSOs per hour by band series')
+    parser.add_argument('--qsos', type=int, default=200000, help='number of QSOs in the log')
+    parser.add_argument('--hours', type=int, default=48, help='number of hours the log covers')
+    parser.add_argument('--iterations', type=int, default=5, help='number of iterations, best is reported')
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    random.seed(1)
+    db, row_count = make_database(args.qsos, args.hours)
+    cursor = db.cursor()
+    rows = query(cursor)
+    print('%d QSOs, %d minute by band rows, %d %d minute bucket by band rows' % (
+        args.qsos, row_count, len(rows), config.RATE_BUCKET_MINUTES))
+
+    qso_counts, qsos_by_band = rates_legacy(rows)
+    (bucket_times, rates), new_qsos_by_band = rates_numpy(rows)
+    if qsos_by_band != new_qsos_by_band or not np.array_equal(np.array(qso_counts[1:]), rates[:, 1:].T):
+        raise ValueError('rate series disagree!')
+
+    run('query', query, cursor, args.iterations)
+    before = run('legacy', rates_legacy, rows, args.iterations)
+    after = run('numpy', rates_numpy, rows, args.iterations)
+    print('series speedup: %.1fx' % (before / after))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,201 @@
+# n1mm_view chart engine
+# draws the charts from a statistics snapshot, on a pool of worker processes.
+
+import collections
+import concurrent.futures
+import hashlib
+import logging
+import pickle
+import time
+
+import config
+import graphics
+
+__author__ = 'Jeffrey B. Otterson, N1KDO'
+__copyright__ = 'Copyright 2016, 2017, 2019 Jeffrey B. Otterson'
+__license__ = 'Simplified BSD'
+
+""" the charts by name, each is drawn from the snapshot fields its graphics.chart_inputs declares """
+CHARTS = {
+    'qso_summary_table': graphics.qso_summary_table,
+    'qso_rates_table': graphics.qso_rates_table,
+    'qso_operators_graph': graphics.qso_operators_graph,
+    'qso_operators_table': graphics.qso_operators_table,
+    'qso_stations_graph': graphics.qso_stations_graph,
+    'qso_bands_graph': graphics.qso_bands_graph,
+    'qso_modes_graph': graphics.qso_modes_graph,
+    'qso_rates_chart': graphics.qso_rates_chart,
+    'sections_worked_map': graphics.draw_map,
+}
+
+
+def chart_inputs(name, snapshot):
+    """
+    return the values from snapshot the chart called name is drawn from
+    """
+    return [getattr(snapshot, field) for field in CHARTS[name].inputs]
+
+
+def inputs_hash(name, size, inputs):
+    """
+    return a hash of everything the chart called name will look like.
+    """
+    every = CHARTS[name].every
+    digest = hashlib.sha1(pickle.dumps((size, inputs), protocol=pickle.HIGHEST_PROTOCOL))
+    if every is not None:
+        digest.update(b'%d' % (time.time() // every))
+    return digest.digest()
+
+
+def draw_chart(name, size, inputs):
+    """
+    draw the chart called name, return the RGB image data and its size.  this runs in the worker processes.
+    """
+    logging.debug('drawing %s', name)
+    return CHARTS[name](size, *inputs)
+
+
+class ChartEngine:
+    """
+    draws charts on CHART_WORKERS worker processes, and hands each one over as soon as it is done.
+    a chart not done CHART_TIMEOUT seconds after it was asked for is given up on, so one slow chart cannot hold
+    up the others.  it is delivered by the first draw after its worker has finished it, and is not asked for
+    again until then.
+    a chart whose inputs are the same as the last time it was delivered is skipped.
+    with fewer than 2 workers the charts are drawn one after another in this process.
+    """
+
+    def __init__(self, workers=None, timeout=None):
+        self.workers = config.CHART_WORKERS if workers is None else workers
+        self.timeout = config.CHART_TIMEOUT if timeout is None else timeout
+        self.executor = None
+        self.late = {}  # chart name: (future, inputs hash) of a chart that timed out and is still being drawn
+        self.hashes = {}  # chart name: inputs_hash of the last delivered drawing
+        self.drawn = collections.Counter()
+        self.skipped = collections.Counter()
+        self.start()
+
+    def start(self):
+        if self.workers > 1:
+            logging.debug('starting %d chart workers', self.workers)
+            self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.workers)
+
+    def counts(self):
+        """
+        return how many times each chart has been drawn, and skipped because it had not changed
+        """
+        return {name: (self.drawn[name], self.skipped[name]) for name in CHARTS}
+
+    def log_counts(self):
+        logging.info('charts drawn / skipped: %s', ', '.join('%s %d/%d' % (name, drawn, skipped)
+                                                              for name, (drawn, skipped) in self.counts().items()))
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+        self.late = {}
+
+    def deliver(self, deliver, name, digest, image_data, image_size):
+        self.drawn[name] += 1
+        try:
+            deliver(name, image_data, image_size)
+            # a chart with nothing to draw is asked for again, so it is delivered once it has.
+            if image_data is not None:
+                self.hashes[name] = digest
+        except Exception as e:
+            logging.exception(e)
+
+    def deliver_late(self, deliver):
+        """
+        deliver the charts that timed out and have been finished since.
+        """
+        for name, (future, digest) in list(self.late.items()):
+            if not future.done():
+                continue
+            del self.late[name]
+            try:
+                image_data, image_size = future.result()
+            except Exception as e:
+                logging.error('late chart %s failed: %s', name, e)
+                continue
+            logging.debug('delivering late chart %s', name)
+            self.deliver(deliver, name, digest, image_data, image_size)
+
+    def changed(self, names, size, snapshot):
+        """
+        return {name: (inputs, hash)} of the charts in names whose inputs changed since they were last delivered
+        """
+        charts = {}
+        for name in names:
+            inputs = chart_inputs(name, snapshot)
+            digest = inputs_hash(name, size, inputs)
+            if self.hashes.get(name) == digest:
+                self.skipped[name] += 1
+            else:
+                charts[name] = (inputs, digest)
+        return charts
+
+    def draw(self, names, size, snapshot, deliver):
+        """
+        draw the charts in names from snapshot, calling deliver(name, image_data, image_size) for each one
+        as it is done, in no particular order.  charts that have not changed are not drawn or delivered.
+        returns the names of the charts that were not delivered.
+        """
+        self.deliver_late(deliver)
+        charts = self.changed(names, size, snapshot)
+        logging.debug('drawing %d charts, %d have not changed', len(charts), len(names) - len(charts))
+        if self.executor is None:
+            failed = []
+            for name, (inputs, digest) in charts.items():
+                try:
+                    image_data, image_size = draw_chart(name, size, inputs)
+                except Exception as e:
+                    logging.exception(e)
+                    failed.append(name)
+                    continue
+                self.deliver(deliver, name, digest, image_data, image_size)
+            return failed
+
+        failed = []
+        futures = {}
+        for name, (inputs, digest) in charts.items():
+            if name in self.late:
+                logging.warning('chart %s is still being drawn from an earlier update', name)
+                failed.append(name)
+                continue
+            futures[self.executor.submit(draw_chart, name, size, inputs)] = name, digest
+
+        deadline = time.monotonic() + self.timeout
+        pending = set(futures)
+        broken = False
+        while pending:
+            done, pending = concurrent.futures.wait(pending, timeout=max(0.0, deadline - time.monotonic()),
+                                                    return_when=concurrent.futures.FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                name, digest = futures[future]
+                try:
+                    image_data, image_size = future.result()
+                except concurrent.futures.BrokenExecutor as e:
+                    logging.error('chart worker died drawing %s: %s', name, e)
+                    failed.append(name)
+                    broken = True
+                    continue
+                except Exception as e:
+                    logging.exception(e)
+                    failed.append(name)
+                    continue
+                self.deliver(deliver, name, digest, image_data, image_size)
+
+        for future in pending:
+            name, digest = futures[future]
+            logging.warning('chart %s took more than %d seconds, giving up on it', name, self.timeout)
+            failed.append(name)
+            if not future.cancel():
+                self.late[name] = future, digest
+        if broken:
+            self.shutdown()
+            self.start()
+        return failed
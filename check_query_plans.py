@@ -0,0 +1,118 @@
+#!/usr/bin/python3
+"""
+n1mm_view query plan check
+runs every dataaccess query against a scratch database, and shows the sqlite
+query plan for each.  exits with an error if a query scans a table that grows
+with the log, or sorts into a temporary b-tree.
+the counter tables and the operator and station tables have a row per group,
+they are meant to be read whole.
+"""
+
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+
+import config
+import dataaccess
+
+__author__ = 'Jeffrey B. Otterson, N1KDO'
+__copyright__ = 'Copyright 2016, 2017, 2019 Jeffrey B. Otterson'
+__license__ = 'Simplified BSD'
+
+""" tables that grow with the log, and must only be searched by an index """
+LOG_TABLES = ['qso_log', 'qso_log_changes']
+
+
+class Operators:
+    def lookup_operator_id(self, operator):
+        return 1
+
+
+class Stations:
+    def lookup_station_id(self, station):
+        return 1
+
+
+def run_queries(db):
+    """
+    run everything the collector and dashboard do to the database, return the sql statements executed.
+    """
+    statements = []
+    cursor = db.cursor()
+    cursor.execute("INSERT INTO operator (id, name) VALUES (1, 'N1KDO');")
+    cursor.execute("INSERT INTO station (id, name) VALUES (1, 'STATION-1');")
+    db.commit()
+
+    db.set_trace_callback(statements.append)
+    now = time.gmtime()
+    rows = [dataaccess.make_contact_row(Operators(), Stations(), now, 'N1KDO', '14', 'CW', 'N1KDO', 'STATION-1',
+                                        1400000, 1400000, call, '599', '599', '2A', 'GA', '')
+            for call in ('W1AW', 'K4AA', 'N4N')]
+    dataaccess.record_contacts(db, cursor, rows)
+    dataaccess.replace_contact(db, cursor, rows[0], now, 'W1AW')
+    dataaccess.delete_contact(db, cursor, now, 1, 'K4AA')
+    dataaccess.delete_contact(db, cursor, now, None, 'N4N')
+    dataaccess.prune_changes(db, config.CHANGE_LOG_SIZE)
+
+    dataaccess.get_stats_snapshot(db)
+    model = dataaccess.AggregateModel()
+    model.update(db)
+    dataaccess.record_contacts(db, cursor, rows)
+    dataaccess.delete_contact(db, cursor, now, 1, 'K4AA')
+    model.update(db)
+    db.set_trace_callback(None)
+    cursor.close()
+    return statements
+
+
+def check_plan(db, sql):
+    """
+    return the query plan for sql, and a list of problems with it.
+    """
+    plan = [row[3] for row in db.execute('EXPLAIN QUERY PLAN ' + sql)]
+    problems = []
+    for step in plan:
+        words = step.replace('SCAN TABLE', 'SCAN').split()  # older sqlite says SCAN TABLE
+        if 'TEMP B-TREE' in step:
+            problems.append(step)
+        elif words[0] == 'SCAN' and words[1] in LOG_TABLES:
+            problems.append(step)
+    return plan, problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description='check the query plans of the dataaccess queries')
+    parser.add_argument('--verbose', action='store_true', help='show the plans of all the queries')
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as directory:
+        db = dataaccess.open_database(os.path.join(directory, 'check.db'))
+        cursor = db.cursor()
+        dataaccess.create_tables(db, cursor)
+        cursor.close()
+        statements = run_queries(db)
+
+        failures = 0
+        checked = set()
+        for sql in statements:
+            if sql in checked or sql.split()[0].upper() not in ('SELECT', 'INSERT', 'UPDATE', 'DELETE'):
+                continue
+            checked.add(sql)
+            plan, problems = check_plan(db, sql)
+            if problems or args.verbose:
+                print('%s %s' % ('FAIL' if problems else 'ok  ', ' '.join(sql.split())))
+                for step in plan:
+                    print('         %s' % step)
+            failures += len(problems) > 0
+        db.close()
+
+    print('%d queries checked, %d failed' % (len(checked), failures))
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -5,11 +5,18 @@ This program collects N1MM+ "Contact Info" broadcasts and saves data from the br
 in database tables.
 """
 
+import asyncio
+import html
 import logging
-import sqlite3
+import os
+import queue
+import re
+import signal
+import threading
 import time
+from collections import Counter, OrderedDict
 from hashlib import md5
-from socket import socket, AF_INET, SOCK_DGRAM, SOL_SOCKET, SO_BROADCAST, SO_REUSEADDR
+from socket import socket, AF_INET, AF_INET6, SOCK_DGRAM, SOL_SOCKET, SO_BROADCAST, SO_RCVBUF, SO_REUSEADDR
 from xml.dom.minidom import parseString
 
 import config
@@ -20,6 +27,12 @@ __copyright__ = 'Copyright 2016, 2017, 2019 Jeffrey B. Otterson'
 __license__ = 'Simplified BSD'
 
 BROADCAST_BUF_SIZE = 2048
+""" how far into a message to look for the message type """
+CLASSIFY_BYTES = 256
+""" number of seconds between message count and receive statistics log entries """
+STATS_LOG_INTERVAL = 300
+""" number of seconds the storage thread waits for a message before checking if it should stop """
+STORAGE_POLL_SECONDS = 0.5
 
 logging.basicConfig(format='%(asctime)s.%(msecs)03d %(levelname)-8s %(message)s', datefmt='%Y-%m-%d %H:%M:%S',
                     level=config.LOG_LEVEL)
@@ -43,6 +56,8 @@ class Operators:
         """
         lookup the operator id for the supplied operator text.
         if the operator is not found, create it.
+        the new operator is committed at once, so rolling back a batch of contacts cannot take it back
+        while its id is still cached here.
         """
         oid = self.operators.get(operator)
         if oid is None:
@@ -69,11 +84,228 @@ class Stations:
         sid = self.stations.get(station)
         if sid is None:
             self.cursor.execute("insert into station (name) values (?);", (station,))
-            self.db.commit()
+            self.db.commit()  # like operators, so a rolled back batch cannot take it back
             sid = self.cursor.lastrowid
             self.stations[station] = sid
         return sid
 
+    def get_station_id(self, station):
+        """
+        return the station id for the supplied station name, or None if it is not known.
+        """
+        return self.stations.get(station)
+
+
+class ContactWriter:
+    """
+    write-behind queue for contacts.
+    queued contacts are written in one transaction when WRITE_BATCH_SIZE contacts are waiting,
+    or WRITE_BATCH_MILLISECONDS after the oldest one was queued, whichever comes first.
+    """
+
+    def __init__(self, db, cursor, batch_size=None, batch_milliseconds=None):
+        self.db = db
+        self.cursor = cursor
+        self.batch_size = config.WRITE_BATCH_SIZE if batch_size is None else batch_size
+        self.batch_seconds = (config.WRITE_BATCH_MILLISECONDS if batch_milliseconds is None
+                              else batch_milliseconds) / 1000.0
+        self.rows = []
+        self.flush_time = None
+
+    def add(self, row):
+        """
+        queue a qso_log row for writing
+        """
+        self.rows.append(row)
+        if self.flush_time is None:
+            self.flush_time = time.time() + self.batch_seconds
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """
+        write all the queued contacts now
+        """
+        if len(self.rows) > 0:
+            logging.debug('writing %d contacts', len(self.rows))
+            rows = self.rows
+            self.rows = []
+            dataaccess.record_contacts(self.db, self.cursor, rows)
+        self.flush_time = None
+
+    def replace(self, row, old_timestamp=None, old_callsign=None):
+        """
+        write an edited contact, after anything already queued.
+        """
+        self.flush()
+        dataaccess.replace_contact(self.db, self.cursor, row, old_timestamp, old_callsign)
+
+    def flush_if_due(self):
+        if self.flush_time is not None and time.time() >= self.flush_time:
+            self.flush()
+
+    def timeout(self):
+        """
+        return the number of seconds until the queued contacts must be written, or None if nothing is queued.
+        """
+        if self.flush_time is None:
+            return None
+        return max(self.flush_time - time.time(), 0.001)
+
+
+class MessageQueue:
+    """
+    bounded queue of received messages waiting to be parsed and stored, with statistics.
+    """
+
+    def __init__(self, maxsize):
+        self.messages = queue.Queue(maxsize)
+        self.received = 0
+        self.dropped = 0
+        self.high_water = 0
+
+    def put(self, data):
+        self.received += 1
+        try:
+            self.messages.put_nowait(data)
+        except queue.Full:
+            self.dropped += 1
+            return
+        depth = self.messages.qsize()
+        if depth > self.high_water:
+            self.high_water = depth
+
+    def get(self, timeout):
+        return self.messages.get(timeout=timeout)
+
+    def get_nowait(self):
+        return self.messages.get_nowait()
+
+    def qsize(self):
+        return self.messages.qsize()
+
+
+class CollectorProtocol(asyncio.DatagramProtocol):
+    """
+    receives datagrams on one listen address and queues them, it does nothing else.
+    """
+
+    def __init__(self, messages):
+        self.messages = messages
+
+    def datagram_received(self, data, addr):
+        self.messages.put(data)
+
+    def error_received(self, exc):
+        logging.warning('UDP receive error: %s', exc)
+
+
+class Storage(threading.Thread):
+    """
+    parses and stores the queued messages.
+    this runs on its own thread so slow database writes never hold up receiving.
+    """
+
+    def __init__(self, db, cursor, messages):
+        super().__init__(name='storage')
+        self.db = db
+        self.messages = messages
+        self.operators = Operators(db, cursor)
+        self.stations = Stations(db, cursor)
+        self.writer = ContactWriter(db, cursor)
+        self.seen = DuplicateFilter()
+        self.stopping = threading.Event()
+
+    def run(self):
+        next_checkpoint = time.time() + config.DATABASE_CHECKPOINT_SECONDS
+        try:
+            while not self.stopping.is_set():
+                wait = self.writer.timeout()
+                if wait is None or wait > STORAGE_POLL_SECONDS:
+                    wait = STORAGE_POLL_SECONDS
+                try:
+                    self.process(self.messages.get(timeout=wait))
+                except queue.Empty:
+                    pass
+                self.writer.flush_if_due()
+                if time.time() >= next_checkpoint:
+                    dataaccess.checkpoint(self.db)
+                    dataaccess.prune_changes(self.db, config.CHANGE_LOG_SIZE)
+                    next_checkpoint = time.time() + config.DATABASE_CHECKPOINT_SECONDS
+        finally:
+            # process whatever is still queued before shutting down.
+            while True:
+                try:
+                    self.process(self.messages.get_nowait())
+                except queue.Empty:
+                    break
+            self.writer.flush()
+            dataaccess.checkpoint(self.db, 'TRUNCATE')
+
+    def process(self, data):
+        try:
+            process_message(self.writer, self.operators, self.stations, data, self.seen)
+        except Exception:
+            logging.exception('Exception processing message.')
+
+    def stop(self):
+        self.stopping.set()
+        self.join()
+
+
+def kernel_drop_count(sock):
+    """
+    return the number of datagrams the kernel has dropped for this socket because its receive buffer was full.
+    returns None if this is unknown, it only works on linux.
+    """
+    try:
+        inode = os.fstat(sock.fileno()).st_ino
+        for proc_file_name in ('/proc/net/udp', '/proc/net/udp6'):
+            with open(proc_file_name) as proc_file:
+                next(proc_file)  # skip header
+                for line in proc_file:
+                    fields = line.split()
+                    if int(fields[9]) == inode:
+                        return int(fields[12])
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+class DuplicateFilter:
+    """
+    remembers the checksums of recent contact messages so re-broadcasts can be ignored.
+    holds at most max_size checksums, and forgets any not seen for max_age seconds,
+    so memory use stays flat no matter how long the contest is.
+    the database's unique index catches anything older.
+    """
+
+    def __init__(self, max_size=None, max_age=None):
+        self.max_size = config.DUPLICATE_FILTER_SIZE if max_size is None else max_size
+        self.max_age = config.DUPLICATE_FILTER_SECONDS if max_age is None else max_age
+        self.seen = OrderedDict()  # checksum -> time last seen, least recently seen first
+
+    def __contains__(self, checksum_value):
+        self.expire(time.time())
+        return checksum_value in self.seen
+
+    def __len__(self):
+        return len(self.seen)
+
+    def add(self, checksum_value):
+        self.seen[checksum_value] = time.time()
+        self.seen.move_to_end(checksum_value)
+        while len(self.seen) > self.max_size:
+            self.seen.popitem(last=False)
+
+    def expire(self, now):
+        oldest = now - self.max_age
+        while len(self.seen) > 0:
+            checksum_value, seen_time = next(iter(self.seen.items()))
+            if seen_time >= oldest:
+                break
+            del self.seen[checksum_value]
+
 
 def checksum(data):
     """
@@ -92,111 +324,291 @@ def convert_timestamp(s):
     return time.strptime(s, '%Y-%m-%d %H:%M:%S')
 
 
-def get_from_dom(dom, name):
+""" matches the root element tag after any xml declaration, comments and whitespace """
+ROOT_ELEMENT_RE = re.compile(rb'\s*(?:<\?.*?\?>\s*)?(?:<!--.*?-->\s*)*<([A-Za-z_][\w.-]*)(?:\s[^>]*)?/?>', re.DOTALL)
+""" matches a simple leaf element, <name>text</name> or <name/> """
+LEAF_ELEMENT_RE = re.compile(rb'<([A-Za-z_][\w.-]*)(?:\s[^>]*?)?(?:/>|>([^<]*)</\1\s*>)')
+
+
+def parse_message_fast(data):
     """
-    safely extract a field from a dom.
-    return empty string on any failures.
+    single pass parser for the flat xml messages N1MM+ sends.
+    returns (message_type, fields) where fields is a dict of element name to text,
+    or None if the message does not look like a flat N1MM+ message.
     """
+    match = ROOT_ELEMENT_RE.match(data)
+    if match is None:
+        return None
+    root = match.group(1)
+    body_start = match.end()
+    body_end = data.rfind(b'</' + root)
+    if body_end < body_start:
+        return None
+    body = data[body_start:body_end]
+    if b'<!' in body:  # CDATA or comments, let the real parser sort it out.
+        return None
+    fields = {}
     try:
-        fc = dom.getElementsByTagName(name)[0].firstChild
-        if fc is None:
-            return ''
-        else:
-            return fc.nodeValue
-    except Exception as e:
-        return ''
+        for element in LEAF_ELEMENT_RE.finditer(body):
+            name = element.group(1).decode('ascii')
+            if name not in fields:
+                value = element.group(2)
+                if value is None:
+                    fields[name] = ''
+                else:
+                    value = value.decode('utf-8')
+                    if '&' in value:
+                        value = html.unescape(value)
+                    fields[name] = value
+    except UnicodeDecodeError:
+        return None
+    return root.decode('ascii'), fields
+
+
+def parse_message_dom(data):
+    """
+    parse a message with minidom, slow but tolerant.
+    returns (message_type, fields) like parse_message_fast.
+    """
+    dom = parseString(data)
+    root = dom.documentElement
+    fields = {}
+    for node in root.getElementsByTagName('*'):
+        if node.tagName not in fields:
+            fc = node.firstChild
+            fields[node.tagName] = fc.nodeValue if fc is not None and fc.nodeValue is not None else ''
+    return root.tagName, fields
 
 
-def process_message(db, cursor, operators, stations, data, seen):
+def parse_message(data):
     """
-    Process a N1MM+ contactinfo message
+    parse a N1MM+ message into (message_type, fields).
+    uses the fast parser, and falls back to minidom for anything it does not understand.
     """
-    #  logging.debug(data)
-    dom = parseString(data)
-    if dom.getElementsByTagName("contactinfo").length == 1 or dom.getElementsByTagName("contactreplace").length == 1:
-        checksum_value = checksum(data)
-        if checksum_value in seen:
-            logging.debug('duplicate message')
-            return
-        seen.add(checksum_value)
-        qso_timestamp = get_from_dom(dom, "timestamp")
-        mycall = get_from_dom(dom, "mycall")
-        band = get_from_dom(dom, "band")
-        mode = get_from_dom(dom, "mode")
-        operator = get_from_dom(dom, "operator")
-        station_name = get_from_dom(dom, "StationName")
-        if station_name == '':
-            station_name = get_from_dom(dom, "NetBiosName")
-        station = station_name
-        rx_freq = int(get_from_dom(dom, "rxfreq")) * 10  # convert to Hz
-        tx_freq = int(get_from_dom(dom, "txfreq")) * 10
-        callsign = get_from_dom(dom, "call")
-        rst_sent = get_from_dom(dom, "snt")
-        rst_recv = get_from_dom(dom, "rcv")
-        exchange = get_from_dom(dom, "exchange1")
-        section = get_from_dom(dom, "section")
-        comment = get_from_dom(dom, "comment")
-
-        # convert qso_timestamp to datetime object
-        timestamp = convert_timestamp(qso_timestamp)
-
-        dataaccess.record_contact(db, cursor, operators, stations,
-                                  timestamp, mycall, band, mode, operator, station,
-                                  rx_freq, tx_freq, callsign, rst_sent, rst_recv,
-                                  exchange, section, comment)
-    elif dom.getElementsByTagName("RadioInfo").length == 1:
-        logging.debug("Received radioInfo message")
-    elif dom.getElementsByTagName("contactdelete").length == 1:
-        qso_timestamp = get_from_dom(dom, "timestamp")
-        callsign = get_from_dom(dom, "call")
-        station_name = get_from_dom(dom, "StationName")
-        station = station_name
-        #  convert qso_timestamp to datetime object
-        timestamp = convert_timestamp(qso_timestamp)
-        dataaccess.delete_contact(db, cursor, timestamp, station, callsign)
-    elif dom.getElementsByTagName("dynamicresults").length == 1:
-        logging.debug("Received Score message")
+    parsed = parse_message_fast(data)
+    if parsed is None:
+        logging.debug('fast parse failed, using minidom')
+        parsed = parse_message_dom(data)
+    return parsed
+
+
+def classify_message(data):
+    """
+    cheaply find the type of a message from its first bytes, without any xml parsing.
+    returns the root element name as bytes, or None if it could not be found.
+    """
+    match = ROOT_ELEMENT_RE.match(data, 0, CLASSIFY_BYTES)
+    if match is None:
+        return None
+    return match.group(1)
+
+
+def process_contact(writer, operators, stations, data, seen):
+    """
+    Process a N1MM+ contactinfo or contactreplace message
+    """
+    checksum_value = checksum(data)
+    duplicate = checksum_value in seen
+    seen.add(checksum_value)
+    if duplicate:
+        logging.debug('duplicate message')
+        return
+    message_type, fields = parse_message(data)
+    qso_timestamp = fields.get('timestamp', '')
+    mycall = fields.get('mycall', '')
+    band = fields.get('band', '')
+    mode = fields.get('mode', '')
+    operator = fields.get('operator', '')
+    station_name = fields.get('StationName', '')
+    if station_name == '':
+        station_name = fields.get('NetBiosName', '')
+    station = station_name
+    rx_freq = int(fields.get('rxfreq', '')) * 10  # convert to Hz
+    tx_freq = int(fields.get('txfreq', '')) * 10
+    callsign = fields.get('call', '')
+    rst_sent = fields.get('snt', '')
+    rst_recv = fields.get('rcv', '')
+    exchange = fields.get('exchange1', '')
+    section = fields.get('section', '')
+    comment = fields.get('comment', '')
+
+    # convert qso_timestamp to datetime object
+    timestamp = convert_timestamp(qso_timestamp)
+
+    row = dataaccess.make_contact_row(operators, stations,
+                                      timestamp, mycall, band, mode, operator, station,
+                                      rx_freq, tx_freq, callsign, rst_sent, rst_recv,
+                                      exchange, section, comment)
+    if message_type == 'contactreplace':
+        # newer N1MM+ versions say what the contact was before it was edited.
+        old_timestamp = fields.get('oldtimestamp', '')
+        old_callsign = fields.get('oldcall', '')
+        if old_timestamp != '' and old_callsign != '':
+            writer.replace(row, convert_timestamp(old_timestamp), old_callsign)
+        else:
+            writer.replace(row)
     else:
+        writer.add(row)
+
+
+def process_delete(writer, operators, stations, data, seen):
+    """
+    Process a N1MM+ contactdelete message
+    """
+    message_type, fields = parse_message(data)
+    qso_timestamp = fields.get('timestamp', '')
+    callsign = fields.get('call', '')
+    station_name = fields.get('StationName', '')
+    if station_name == '':
+        station_name = fields.get('NetBiosName', '')
+    station = station_name
+    #  convert qso_timestamp to datetime object
+    timestamp = convert_timestamp(qso_timestamp)
+    writer.flush()  # the contact being deleted might still be queued.
+    dataaccess.delete_contact(writer.db, writer.cursor, timestamp, stations.get_station_id(station), callsign)
+
+
+def process_unknown(writer, operators, stations, data, seen):
+    """
+    the classifier did not recognize this message, take a slow look at it.
+    """
+    try:
+        message_type = parse_message(data)[0].encode()
+    except Exception:
+        message_type = None
+    handler = MESSAGE_HANDLERS.get(message_type, process_unknown)
+    if handler is process_unknown:
         logging.warning('unknown message received, ignoring.')
         logging.debug(data)
+    elif handler is not None:
+        handler(writer, operators, stations, data, seen)
 
 
-def listener(db, cursor):
+"""
+handler for each N1MM+ message type, keyed by root element name.
+message types mapped to None are counted and dropped without being parsed.
+"""
+MESSAGE_HANDLERS = {
+    b'contactinfo': process_contact,
+    b'contactreplace': process_contact,
+    b'contactdelete': process_delete,
+    b'RadioInfo': None,
+    b'dynamicresults': None,
+    b'AppInfo': None,
+    b'spot': None,
+    b'lookupinfo': None,
+}
+
+""" count of messages received by type """
+message_counts = Counter()
+
+
+def process_message(writer, operators, stations, data, seen):
     """
-    this is the UDP listener, the main loop.
+    Process a N1MM+ message
+    """
+    #  logging.debug(data)
+    message_type = classify_message(data)
+    message_counts[message_type] += 1
+    handler = MESSAGE_HANDLERS.get(message_type, process_unknown)
+    if handler is not None:
+        handler(writer, operators, stations, data, seen)
+
+
+def log_message_counts():
+    """
+    log the mix of message types received so far
+    """
+    counts = ', '.join('%s=%d' % ('unknown' if message_type is None else message_type.decode(), count)
+                       for message_type, count in message_counts.most_common())
+    logging.info('messages received: %s', counts)
+
+
+def log_receive_stats(messages, sockets):
+    """
+    log the state of the receive queue and how many messages were lost
+    """
+    kernel_drops = 0
+    for sock in sockets:
+        drops = kernel_drop_count(sock)
+        if drops is None:
+            kernel_drops = None
+            break
+        kernel_drops += drops
+    logging.info('receive queue: received=%d, depth=%d, high water=%d, queue drops=%d, kernel drops=%s',
+                 messages.received, messages.qsize(), messages.high_water, messages.dropped, kernel_drops)
+
+
+def open_socket(address, port):
+    """
+    open a UDP socket that can receive N1MM+ broadcasts on address and port.
     """
-    s = socket(AF_INET, SOCK_DGRAM)
+    s = socket(AF_INET6 if ':' in address else AF_INET, SOCK_DGRAM)
     s.setsockopt(SOL_SOCKET, SO_BROADCAST, 1)
     s.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
-    try:
-        s.bind(('', config.N1MM_BROADCAST_PORT))
-    except:
-        logging.critical('Error connecting to the UDP stream.')
-        return
+    s.setsockopt(SOL_SOCKET, SO_RCVBUF, config.RECEIVE_BUFFER_BYTES)
+    logging.debug('socket receive buffer is %d bytes', s.getsockopt(SOL_SOCKET, SO_RCVBUF))
+    s.bind((address, port))
+    return s
+
 
-    operators = Operators(db, cursor)
-    stations = Stations(db, cursor)
+async def listener(messages):
+    """
+    this is the UDP listener, the main loop.
+    listens on every address in N1MM_LISTEN_ADDRESSES and queues everything received
+    for the storage thread, until SIGINT or SIGTERM.
+    """
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(signum, stop.set)
+        except NotImplementedError:  # windows
+            signal.signal(signum, lambda signum, frame: loop.call_soon_threadsafe(stop.set))
 
-    seen = set()
-    run = True
-    while run:
+    transports = []
+    sockets = []
+    for address, port in config.N1MM_LISTEN_ADDRESSES:
         try:
-            udp_data = s.recv(BROADCAST_BUF_SIZE)
-            process_message(db, cursor, operators, stations, udp_data, seen)
+            s = open_socket(address, port)
+        except OSError:
+            logging.critical('Error connecting to the UDP stream on %s:%d.', address or '*', port)
+            continue
+        transport, protocol = await loop.create_datagram_endpoint(lambda: CollectorProtocol(messages), sock=s)
+        transports.append(transport)
+        sockets.append(s)
+        logging.info('listening on %s:%d', address or '*', port)
+    if len(transports) == 0:
+        return
 
-        except KeyboardInterrupt:
-            logging.info('Keyboard interrupt, shutting down...')
-            s.close()
-            run = False
+    try:
+        while not stop.is_set():
+            try:
+                await asyncio.wait_for(stop.wait(), STATS_LOG_INTERVAL)
+            except asyncio.TimeoutError:
+                log_message_counts()
+                log_receive_stats(messages, sockets)
+        logging.info('Stop requested, shutting down...')
+    finally:
+        log_receive_stats(messages, sockets)
+        for transport in transports:
+            transport.close()
 
 
 def main():
     logging.info('Collector started...')
-    db = sqlite3.connect(config.DATABASE_FILENAME)
+    db = dataaccess.open_database(check_same_thread=False)
     cursor = db.cursor()
     dataaccess.create_tables(db, cursor)
-    listener(db, cursor)
-    db.close()
+    messages = MessageQueue(config.RECEIVE_QUEUE_SIZE)
+    storage = Storage(db, cursor, messages)
+    storage.start()
+    try:
+        asyncio.run(listener(messages))
+    finally:
+        storage.stop()
+        log_message_counts()
+        db.close()
 
     logging.info('Collector done...')
 
@@ -7,6 +7,18 @@ import logging
 
 """ name of database file """
 DATABASE_FILENAME = 'n1mm_view.db'
+""" sqlite synchronous setting for the collector, NORMAL is safe in WAL mode and only FULL fsyncs every commit """
+DATABASE_SYNCHRONOUS = 'NORMAL'
+""" number of milliseconds a database connection waits for a lock before failing """
+DATABASE_BUSY_TIMEOUT = 5000
+""" sqlite page cache size per connection, in KiB """
+DATABASE_CACHE_KB = 8192
+""" number of bytes of the database file to memory map, 0 to not use memory mapped I/O """
+DATABASE_MMAP_SIZE = 67108864
+""" number of seconds between the collector's WAL checkpoints """
+DATABASE_CHECKPOINT_SECONDS = 60
+""" number of changed and deleted contact records the collector keeps for the dashboard to catch up from """
+CHANGE_LOG_SIZE = 10000
 """ Name of the event/contest """
 EVENT_NAME = 'N4N Field Day'
 """ start time of the event/contest in YYYY-MM-DD hh:mm:ss format """
@@ -17,8 +29,26 @@ EVENT_START_TIME = datetime.datetime.strptime('2017-06-24 18:00:00', '%Y-%m-%d %
 # EVENT_END_TIME = datetime.datetime.strptime('2015-06-28 17:59:59', '%Y-%m-%d %H:%M:%S')
 # EVENT_END_TIME = datetime.datetime.strptime('2016-06-26 17:59:59', '%Y-%m-%d %H:%M:%S')
 EVENT_END_TIME = datetime.datetime.strptime('2017-06-25 17:59:59', '%Y-%m-%d %H:%M:%S')
+""" collector writes contacts to the database in batches of up to this many """
+WRITE_BATCH_SIZE = 20
+""" maximum number of milliseconds a contact waits in the collector before being written to the database """
+WRITE_BATCH_MILLISECONDS = 1000
+""" number of recent contact messages the collector remembers to ignore re-broadcasts """
+DUPLICATE_FILTER_SIZE = 5000
+""" number of seconds the collector remembers a contact message to ignore re-broadcasts """
+DUPLICATE_FILTER_SECONDS = 3600
+""" maximum number of received messages the collector holds in memory waiting to be processed """
+RECEIVE_QUEUE_SIZE = 10000
+""" size of the collector's kernel socket receive buffer (SO_RCVBUF), in bytes """
+RECEIVE_BUFFER_BYTES = 1048576
 """ port number used by N1MM+ for UDP broadcasts """
 N1MM_BROADCAST_PORT = 12060
+"""
+(address, port) pairs the collector listens on.  '' is every interface.
+add entries to also collect from TR4W or unicast forwarding, for example
+[('', N1MM_BROADCAST_PORT), ('', 12061), ('192.168.2.10', 12062)]
+"""
+N1MM_LISTEN_ADDRESSES = [('', N1MM_BROADCAST_PORT)]
 """ broadcast IP address, used by log replayer """
 N1MM_BROADCAST_ADDRESS = '192.168.1.255'
 """ n1mm+ log file name used by replayer """
@@ -34,6 +64,22 @@ QTH_LONGITUDE = -84.4616047
 DISPLAY_DWELL_TIME = 6
 """ number of seconds before automatic graph update from database """
 DATA_DWELL_TIME = 60
+""" width in minutes of the time buckets in the QSOs per hour by band chart """
+RATE_BUCKET_MINUTES = 15
+""" lengths in minutes of the sliding windows QSO rates are shown for """
+RATE_WINDOW_MINUTES = [10, 15, 30, 60]
+""" directory the pre-rendered section maps are kept in, see prerender_map.py """
+MAP_CACHE_DIR = 'map_cache'
+""" number of rendered table cells, and of measured ones, the dashboard keeps to draw again """
+TEXT_CACHE_SIZE = 500
+""" number of seconds between moves of the gray line on the sections map """
+GRAY_LINE_SECONDS = 300
+""" number of processes drawing charts at once, 1 to draw them one after another """
+CHART_WORKERS = 3
+""" number of seconds to wait for a chart to be drawn before giving up on it """
+CHART_TIMEOUT = 30
+""" most messages waiting for the dashboard display, there is never more than one for an image or crawl message """
+DISPLAY_QUEUE_SIZE = 20
 """ log level for apps -- one of logging.WARN, logging.INFO, logging.DEBUG """
 LOG_LEVEL = logging.DEBUG
 #
@@ -7,16 +7,18 @@ This program displays QSO statistics collected by the collector.
 from datetime import datetime
 import logging
 import os
-import gc
 import multiprocessing
 import pygame
 import sqlite3
 import sys
 import time
 
+import chartengine
 import config
 import dataaccess
+import framestore
 import graphics
+import latestqueue
 
 __author__ = 'Jeffrey B. Otterson, N1KDO'
 __copyright__ = 'Copyright 2016, 2017, 2019 Jeffrey B. Otterson'
@@ -34,8 +36,22 @@ QSO_RATE_CHART_IMAGE_INDEX = 8
 SECTIONS_WORKED_MAP_INDEX = 9
 IMAGE_COUNT = 10
 
+""" the image index of each chartengine chart """
+CHART_INDEXES = {
+    'qso_summary_table': QSO_COUNTS_TABLE_INDEX,
+    'qso_rates_table': QSO_RATES_TABLE_INDEX,
+    'qso_operators_graph': QSO_OPERATORS_PIE_INDEX,
+    'qso_operators_table': QSO_OPERATORS_TABLE_INDEX,
+    'qso_stations_graph': QSO_STATIONS_PIE_INDEX,
+    'qso_bands_graph': QSO_BANDS_PIE_INDEX,
+    'qso_modes_graph': QSO_MODES_PIE_INDEX,
+    'qso_rates_chart': QSO_RATE_CHART_IMAGE_INDEX,
+    'sections_worked_map': SECTIONS_WORKED_MAP_INDEX,
+}
+
 IMAGE_MESSAGE = 1
 CRAWL_MESSAGE = 2
+FRAME_MESSAGE = 3
 
 IMAGE_FORMAT = 'RGB'
 SAVE_PNG = False
@@ -45,54 +61,38 @@ logging.basicConfig(format='%(asctime)s.%(msecs)03d %(levelname)-8s %(message)s'
 logging.Formatter.converter = time.gmtime
 
 
-def load_data(size, q, last_qso_timestamp):
+def load_data(size, q, last_snapshot, model, engine, frames=None, database=None):
     """
-    load data from the database tables
+    load data from the database tables, and draw the charts that changed with the chartengine.ChartEngine engine.
+    model is the dataaccess.AggregateModel kept between calls, so only new QSOs are read.
+    frames is the framestore.FrameStore the images are sent through, or None to send them through q.
+    database is the database file name, DATABASE_FILENAME by default.
+    returns the statistics snapshot the charts were drawn from.
     """
     logging.debug('load data')
 
-    qso_operators = []
-    qso_stations = []
-    qso_band_modes = []
-    operator_qso_rates = []
-    qsos_per_hour = []
-    qsos_by_section = {}
-
+    snapshot = last_snapshot
     db = None
-    data_updated = False
+    rates_updated = False
 
     try:
         logging.debug('connecting to database')
-        db = sqlite3.connect(config.DATABASE_FILENAME)
-        cursor = db.cursor()
+        db = dataaccess.open_database(database, read_only=True)
         logging.debug('database connected')
 
-        # get timestamp from the last record in the database
-        last_qso_time, message = dataaccess.get_last_qso(cursor)
-
-        logging.debug('old_timestamp = %d, timestamp = %d', last_qso_timestamp, last_qso_time)
-        if last_qso_time != last_qso_timestamp:
+        # only read the statistics if the log has changed since the last snapshot.
+        version = dataaccess.get_qso_log_version(db.cursor())
+        logging.debug('old version = %s, version = %d',
+                      None if last_snapshot is None else last_snapshot.version, version)
+        if last_snapshot is None or version != last_snapshot.version:
             logging.debug('data updated!')
-            data_updated = True
-            q.put((CRAWL_MESSAGE, 3, message))
-
-            # load qso_operators
-            qso_operators = dataaccess.get_operators_by_qsos(cursor)
-
-            # load qso_stations -- maybe useless chartjunk
-            qso_stations = dataaccess.get_station_qsos(cursor)
-
-            # get something else.
-            qso_band_modes = dataaccess.get_qso_band_modes(cursor)
-
-            # load QSOs per Hour by Operator
-            operator_qso_rates = dataaccess.get_qsos_per_hour_per_operator(cursor, last_qso_time)
-
-            # load QSO rates per Hour by Band
-            qsos_per_hour, qsos_per_band = dataaccess.get_qsos_per_hour_per_band(cursor)
-
-        # load QSOs by Section # This has to be done even if no new QSO to advance gray line and since the map is always drawn.
-        qsos_by_section = dataaccess.get_qsos_by_section(cursor)
+            # catch up with the changes in one read transaction, so the charts agree with each other.
+            snapshot = model.update(db)
+            q.put((CRAWL_MESSAGE, 3, snapshot.last_qso_message))
+            rates_updated = True
+        else:
+            # the rates fall as time passes, even when there are no new QSOs.
+            rates_updated = model.update_rates(snapshot)
 
         q.put((CRAWL_MESSAGE, 0, ''))
 
@@ -104,65 +104,42 @@ def load_data(size, q, last_qso_timestamp):
     finally:
         if db is not None:
             logging.debug('Closing DB')
-            cursor.close()
             db.close()
             db = None
 
-    if data_updated:
-        try:
-            image_data, image_size = graphics.qso_summary_table(size, qso_band_modes)
-            enqueue_image(q, QSO_COUNTS_TABLE_INDEX, image_data, image_size)
-        except Exception as e:
-            logging.exception(e)
-        try:
-            image_data, image_size = graphics.qso_rates_table(size, operator_qso_rates)
-            enqueue_image(q, QSO_RATES_TABLE_INDEX, image_data, image_size)
-        except Exception as e:
-            logging.exception(e)
-        try:
-            image_data, image_size = graphics.qso_operators_graph(size, qso_operators)
-            enqueue_image(q, QSO_OPERATORS_PIE_INDEX, image_data, image_size)
-        except Exception as e:
-            logging.exception(e)
-        try:
-            image_data, image_size = graphics.qso_operators_table(size, qso_operators)
-            enqueue_image(q, QSO_OPERATORS_TABLE_INDEX, image_data, image_size)
-        except Exception as e:
-            logging.exception(e)
-        try:
-            image_data, image_size = graphics.qso_stations_graph(size, qso_stations)
-            enqueue_image(q, QSO_STATIONS_PIE_INDEX, image_data, image_size)
-        except Exception as e:
-            logging.exception(e)
-        try:
-            image_data, image_size = graphics.qso_bands_graph(size, qso_band_modes)
-            enqueue_image(q, QSO_BANDS_PIE_INDEX, image_data, image_size)
-        except Exception as e:
-            logging.exception(e)
-        try:
-            image_data, image_size = graphics.qso_modes_graph(size, qso_band_modes)
-            enqueue_image(q, QSO_MODES_PIE_INDEX, image_data, image_size)
-        except Exception as e:
-            logging.exception(e)
-        try:
-            image_data, image_size = graphics.qso_rates_chart(size, qsos_per_hour)
-            enqueue_image(q, QSO_RATE_CHART_IMAGE_INDEX, image_data, image_size)
-        except Exception as e:
-            logging.exception(e)
+    if rates_updated:
+        q.put((CRAWL_MESSAGE, 5, rates_message('Band rates', snapshot.band_rates)))
+        q.put((CRAWL_MESSAGE, 6, rates_message('Station rates', snapshot.station_rates)))
 
-    try:
-        image_data, image_size = graphics.draw_map(size, qsos_by_section)
-        enqueue_image(q, SECTIONS_WORKED_MAP_INDEX, image_data, image_size)
-        gc.collect()
-    except Exception as e:
-        logging.exception(e)
+    # the engine only draws the charts whose data changed, and the map when the gray line moves.
+    engine.draw(list(CHART_INDEXES.keys()), size, snapshot,
+                lambda name, image_data, image_size: enqueue_image(q, CHART_INDEXES[name], image_data, image_size,
+                                                                   frames))
+    return snapshot
 
-    return last_qso_time
+
+def rates_message(title, named_rates):
+    """
+    make a crawl message from (name, [QSOs per hour for each of config.RATE_WINDOW_MINUTES]) pairs
+    """
+    if len(named_rates) == 0:
+        return ''
+    return '%s (%s min): %s' % (title, '/'.join('%d' % window for window in config.RATE_WINDOW_MINUTES),
+                                '  '.join('%s %s' % (name, '/'.join('%d' % rate for rate in window_rates))
+                                          for name, window_rates in named_rates))
 
 
-def enqueue_image(q, image_id, image_data, size):
-    if image_data is not None:
+def enqueue_image(q, image_id, image_data, size, frames=None):
+    """
+    send an image to the display, through the frame store if there is one and the image fits in it.
+    """
+    if image_data is None:
+        return
+    generation = None if frames is None else frames.write(image_id, image_data, size)
+    if generation is None:
         q.put((IMAGE_MESSAGE, image_id, image_data, size))
+    else:
+        q.put((FRAME_MESSAGE, image_id, generation))
 
 
 def delta_time_to_string(delta_time):
@@ -264,29 +241,53 @@ class CrawlMessages:
                 break
 
 
-def update_charts(q, event, size):
+def message_key(message):
+    """
+    the latestqueue.LatestQueue key of a message, a newer image or crawl message for the same index replaces it.
+    """
+    return 'crawl' if message[0] == CRAWL_MESSAGE else 'image', message[1]
+
+
+def update_charts(q, event, size, frame_store=None):
+    """
+    the chart engine process.  frame_store is the FrameStore arguments to attach to the display's frame store.
+    """
     try:
         os.nice(10)
     except AttributeError:
         logging.warn("can't be nice to windows")
     q.put((CRAWL_MESSAGE, 4, 'Chart engine starting...'))
-    last_qso_timestamp = 0
+    snapshot = None
+    model = dataaccess.AggregateModel()
+    engine = chartengine.ChartEngine()
+    frames = None if frame_store is None else framestore.FrameStore(*frame_store)
     q.put((CRAWL_MESSAGE, 4, ''))
 
     try:
         while not event.is_set():
             t0 = time.time()
-            last_qso_timestamp = load_data(size, q, last_qso_timestamp)
+            snapshot = load_data(size, q, snapshot, model, engine, frames)
             t1 = time.time()
             delta = t1 - t0
             update_delay = config.DATA_DWELL_TIME - delta
             if update_delay < 0:
                 update_delay = config.DATA_DWELL_TIME
             logging.debug('Next data update in %f seconds', update_delay)
-            event.wait(update_delay)
+            wait_until = time.time() + update_delay
+            # keep sending the messages the display had no room for.
+            while q.flush() and time.time() < wait_until:
+                if event.wait(0.1):
+                    break
+            event.wait(max(0.0, wait_until - time.time()))
     except Exception as e:
         logging.exception('Exception in update_charts', exc_info=e)
         q.put((CRAWL_MESSAGE, 4, 'Chart engine failed.', graphics.YELLOW, graphics.RED))
+    finally:
+        engine.shutdown()
+        engine.log_counts()
+        q.log_counts('chart engine')
+        if frames is not None:
+            frames.close()
 
 
 def change_image(screen, size, images, image_index, delta):
@@ -305,7 +306,7 @@ def change_image(screen, size, images, image_index, delta):
 def main():
     logging.info('dashboard startup')
     last_qso_timestamp = 0
-    q = multiprocessing.Queue()
+    q = latestqueue.LatestQueue(message_key, config.DISPLAY_QUEUE_SIZE)
 
     process_event = multiprocessing.Event()
 
@@ -318,13 +319,25 @@ def main():
 
     display_size = (size[0], size[1] - graphics.view_font_height)
 
+    # the charts are drawn at the display size, a bigger one is sent through the queue.
+    frames = None
+    frame_store = None
+    if framestore.shared_memory is not None:
+        try:
+            frames = framestore.FrameStore(IMAGE_COUNT, display_size[0] * display_size[1] * 3,
+                                           multiprocessing.Lock())
+            frame_store = (frames.slots, frames.frame_bytes, frames.lock, frames.name)
+        except OSError as e:
+            logging.warning('cannot make the frame store, images will be sent through the queue: %s', e)
+
     logging.debug('display setup')
 
     images[LOGO_IMAGE_INDEX] = pygame.image.load('logo.png')
     crawl_messages = CrawlMessages(screen, size)
     update_crawl_message(crawl_messages)
 
-    proc = multiprocessing.Process(name='image-updater', target=update_charts, args=(q, process_event, display_size))
+    proc = multiprocessing.Process(name='image-updater', target=update_charts,
+                                   args=(q, process_event, display_size, frame_store))
     proc.start()
 
     try:
@@ -372,26 +385,34 @@ def main():
                         paused = not paused
                     else:
                         logging.debug('event key=%d', event.key)
-                while not q.empty():
-                    payload = q.get()
-                    message_type = payload[0]
-                    if message_type == IMAGE_MESSAGE:
-                        n = payload[1]
-                        image = payload[2]
-                        image_size = payload[3]
-                        images[n] = pygame.image.frombuffer(image, image_size, IMAGE_FORMAT)
-                        logging.debug('received image %d', n)
-                    elif message_type == CRAWL_MESSAGE:
-                        n = payload[1]
-                        message = payload[2]
-                        fg = graphics.CYAN
-                        bg = graphics.BLACK
-                        if len(payload) > 3:
-                            fg = payload[3]
-                        if len(payload) > 4:
-                            bg = payload[4]
-                        crawl_messages.set_message(n, message)
-                        crawl_messages.set_message_colors(n, fg, bg)
+
+            # once a frame.  the chart engine sends no more than one message for each image and crawl message.
+            for payload in q.get_latest():
+                message_type = payload[0]
+                if message_type == IMAGE_MESSAGE:
+                    n = payload[1]
+                    image = payload[2]
+                    image_size = payload[3]
+                    images[n] = pygame.image.frombuffer(image, image_size, IMAGE_FORMAT)
+                    logging.debug('received image %d', n)
+                elif message_type == FRAME_MESSAGE:
+                    n = payload[1]
+                    frame = frames.read(n)
+                    if frame is not None:
+                        # the image is shown straight from the frame store's shared memory.
+                        images[n] = pygame.image.frombuffer(frame[0], frame[1], IMAGE_FORMAT)
+                        logging.debug('received frame %d generation %d', n, payload[2])
+                elif message_type == CRAWL_MESSAGE:
+                    n = payload[1]
+                    message = payload[2]
+                    fg = graphics.CYAN
+                    bg = graphics.BLACK
+                    if len(payload) > 3:
+                        fg = payload[3]
+                    if len(payload) > 4:
+                        bg = payload[4]
+                    crawl_messages.set_message(n, message)
+                    crawl_messages.set_message_colors(n, fg, bg)
 
             crawl_messages.crawl_message()
             pygame.display.flip()
@@ -411,6 +432,14 @@ def main():
         logging.warn('chart engine did not exit upon request, killing.')
         proc.terminate()
     logging.debug('update thread has stopped.')
+    if frames is not None:
+        # the images and the last frame read are views of the frame store's memory, and have to go first.
+        images = None
+        frame = None
+        try:
+            frames.close()
+        except BufferError as e:
+            logging.warning('frame store still in use: %s', e)
     logging.info('dashboard exit')
 
 
@@ -2,11 +2,18 @@
 
 import calendar
 from datetime import datetime
+import itertools
 import logging
+import pathlib
+import sqlite3
 import time
+from collections import Counter
+
+import numpy as np
 
 import config
 import constants
+import rates
 
 __author__ = 'Jeffrey B. Otterson, N1KDO'
 __copyright__ = 'Copyright 2016, 2019 Jeffrey B. Otterson'
@@ -17,6 +24,50 @@ logging.basicConfig(format='%(asctime)s.%(msecs)03d %(levelname)-8s %(message)s'
 logging.Formatter.converter = time.gmtime
 
 
+def open_database(filename=None, read_only=False, check_same_thread=True):
+    """
+    open the database filename, DATABASE_FILENAME by default, and set up the connection.
+    the collector opens it read-write, and puts it in WAL mode so that readers and the writer never block each other.
+    everything else opens it read-only.
+    """
+    if filename is None:
+        filename = config.DATABASE_FILENAME
+    timeout = config.DATABASE_BUSY_TIMEOUT / 1000.0
+    if read_only:
+        uri = '%s?mode=ro' % pathlib.Path(filename).absolute().as_uri()
+        db = sqlite3.connect(uri, uri=True, timeout=timeout, check_same_thread=check_same_thread)
+    else:
+        db = sqlite3.connect(filename, timeout=timeout, check_same_thread=check_same_thread)
+    cursor = db.cursor()
+    cursor.execute('PRAGMA busy_timeout = %d;' % config.DATABASE_BUSY_TIMEOUT)
+    cursor.execute('PRAGMA cache_size = %d;' % -config.DATABASE_CACHE_KB)
+    cursor.execute('PRAGMA mmap_size = %d;' % config.DATABASE_MMAP_SIZE)
+    if not read_only:
+        cursor.execute('PRAGMA journal_mode = WAL;')
+        cursor.execute('PRAGMA synchronous = %s;' % config.DATABASE_SYNCHRONOUS)
+        # the collector checkpoints on its own schedule, not in the middle of a commit.
+        cursor.execute('PRAGMA wal_autocheckpoint = 0;')
+    cursor.close()
+    return db
+
+
+def checkpoint(db, mode='PASSIVE'):
+    """
+    copy the WAL back into the database file.
+    PASSIVE does as much as it can without waiting for readers, TRUNCATE waits and empties the WAL.
+    """
+    cursor = db.cursor()
+    try:
+        cursor.execute('PRAGMA wal_checkpoint(%s);' % mode)
+        busy, log_pages, checkpointed_pages = cursor.fetchone()
+        logging.debug('checkpoint %s: busy=%d, WAL pages=%d, checkpointed=%d',
+                      mode, busy, log_pages, checkpointed_pages)
+    except sqlite3.Error:
+        logging.exception('Exception checkpointing database.')
+    finally:
+        cursor.close()
+
+
 def create_tables(db, cursor):
     """
     set up the database tables
@@ -49,18 +100,207 @@ def create_tables(db, cursor):
                    '     comment TEXT);')
     cursor.execute('CREATE INDEX IF NOT EXISTS qso_log_band_id ON qso_log(band_id);')
     cursor.execute('CREATE INDEX IF NOT EXISTS qso_log_mode_id ON qso_log(mode_id);')
-    cursor.execute('CREATE INDEX IF NOT EXISTS qso_log_operator_id ON qso_log(operator_id);')
+    # (operator_id, timestamp) covers the per operator rate query, and makes an operator_id index redundant.
+    cursor.execute('CREATE INDEX IF NOT EXISTS qso_log_operator_timestamp ON qso_log(operator_id, timestamp);')
+    cursor.execute('DROP INDEX IF EXISTS qso_log_operator_id;')
     cursor.execute('CREATE INDEX IF NOT EXISTS qso_log_station_id ON qso_log(station_id);')
     cursor.execute('CREATE INDEX IF NOT EXISTS qso_log_section ON qso_log(section);')
+
+    # a contact is identified by its timestamp, station and callsign.  the unique index keeps
+    # re-broadcast contacts out of the log, even across collector restarts.
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND name = 'qso_log_natural_key';")
+    if cursor.fetchone() is None:
+        cursor.execute('DELETE FROM qso_log WHERE rowid NOT IN \n'
+                       '    (SELECT MIN(rowid) FROM qso_log GROUP BY timestamp, station_id, callsign);')
+        if cursor.rowcount > 0:
+            logging.info('removed %d duplicate contacts from qso_log', cursor.rowcount)
+        cursor.execute('CREATE UNIQUE INDEX qso_log_natural_key ON qso_log(timestamp, station_id, callsign);')
+
+    # qso_log_version counts every change to qso_log, so readers can cheaply tell if anything changed.
+    # max_deleted_rowid is the highest rowid ever deleted, sqlite may hand it out again.
+    cursor.execute('CREATE TABLE IF NOT EXISTS qso_log_version\n'
+                   '    (id INTEGER PRIMARY KEY NOT NULL CHECK (id = 1),\n'
+                   '     version INTEGER NOT NULL,\n'
+                   '     max_deleted_rowid INTEGER NOT NULL DEFAULT 0);')
+    cursor.execute('PRAGMA table_info(qso_log_version);')
+    if 'max_deleted_rowid' not in [row[1] for row in cursor.fetchall()]:
+        cursor.execute('ALTER TABLE qso_log_version ADD COLUMN max_deleted_rowid INTEGER NOT NULL DEFAULT 0;')
+    cursor.execute('INSERT OR IGNORE INTO qso_log_version (id, version) VALUES (1, 0);')
+
+    # qso_log_changes records the old and new values of qso_log rows that were changed or deleted,
+    # so an AggregateModel can catch up without reading the whole log.
+    # change is -1 for the values a row had before, +1 for the values it has now.
+    cursor.execute('CREATE TABLE IF NOT EXISTS qso_log_changes\n'
+                   '    (seq INTEGER PRIMARY KEY AUTOINCREMENT,\n'
+                   '     row_id INTEGER NOT NULL,\n'
+                   '     change INTEGER NOT NULL,\n'
+                   '     timestamp INTEGER NOT NULL,\n'
+                   '     band_id INTEGER NOT NULL,\n'
+                   '     mode_id INTEGER NOT NULL,\n'
+                   '     operator_id INTEGER NOT NULL,\n'
+                   '     station_id INTEGER NOT NULL,\n'
+                   '     section char(4));')
+
+    create_aggregates(db, cursor)
     db.commit()
 
 
-def record_contact(db, cursor, operators, stations,
-                   timestamp, mycall, band, mode, operator, station,
-                   rx_freq, tx_freq, callsign, rst_sent, rst_recv,
-                   exchange, section, comment):
+"""
+counter tables holding QSO counts by operator, station, band and mode, section and minute and band.
+these are kept up to date by triggers on qso_log, so the dashboard reads a row per group
+instead of counting the whole log.
+each is (table name, [(key column, key column type, key expression on a qso_log row)])
+"""
+AGGREGATES = [
+    ('qso_count_by_operator', [('operator_id', 'INTEGER', '{row}.operator_id')]),
+    ('qso_count_by_station', [('station_id', 'INTEGER', '{row}.station_id')]),
+    ('qso_count_by_band_mode', [('band_id', 'INTEGER', '{row}.band_id'),
+                                ('mode_id', 'INTEGER', '{row}.mode_id')]),
+    ('qso_count_by_section', [('section', 'char(4)', "IFNULL({row}.section, '')")]),
+    ('qso_count_by_minute_band', [('minute', 'INTEGER', '{row}.timestamp / 60 * 60'),
+                                  ('band_id', 'INTEGER', '{row}.band_id')]),
+]
+
+
+def minute_bucket_expression():
     """
-    record the results of a contact_message
+    the sql expression for the start of the config.RATE_BUCKET_MINUTES bucket a counter table minute is in
+    """
+    bucket_seconds = config.RATE_BUCKET_MINUTES * 60
+    return 'minute / %d * %d' % (bucket_seconds, bucket_seconds)
+
+
+def create_aggregates(db, cursor):
+    """
+    create the counter tables and the triggers that maintain them.
+    the counts are rebuilt from qso_log if any counter table is new.
+    """
+    rebuild = False
+    for table, keys in AGGREGATES:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = ?;", (table,))
+        if cursor.fetchone() is None:
+            rebuild = True
+        cursor.execute('CREATE TABLE IF NOT EXISTS %s\n'
+                       '    (%s,\n'
+                       '     qso_count INTEGER NOT NULL,\n'
+                       '     PRIMARY KEY (%s)) WITHOUT ROWID;' % (
+                           table,
+                           ', '.join('%s %s NOT NULL' % (column, column_type) for column, column_type, _ in keys),
+                           ', '.join(column for column, _, _ in keys)))
+
+    # the QSOs per hour by band query groups the minute counts by bucket.  this index has the rows in
+    # that order, so they do not have to be sorted.  an index for another bucket width is dropped.
+    bucket_index = 'qso_count_by_minute_band_bucket_%d' % (config.RATE_BUCKET_MINUTES * 60)
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'qso_count_by_minute_band'\n"
+                   "    AND name LIKE 'qso_count_by_minute_band_bucket_%' AND name != ?;", (bucket_index,))
+    for row in cursor.fetchall():
+        cursor.execute('DROP INDEX %s;' % row[0])
+    cursor.execute('CREATE INDEX IF NOT EXISTS %s ON qso_count_by_minute_band(%s, band_id, qso_count);' % (
+        bucket_index, minute_bucket_expression()))
+
+    increment = []
+    decrement = []
+    for table, keys in AGGREGATES:
+        columns = ', '.join(column for column, _, _ in keys)
+        increment.append('INSERT INTO %s (%s, qso_count) VALUES (%s, 1)\n'
+                         '        ON CONFLICT (%s) DO UPDATE SET qso_count = qso_count + 1;' % (
+                             table, columns, ', '.join(expression.format(row='NEW') for _, _, expression in keys),
+                             columns))
+        where = ' AND '.join('%s = %s' % (column, expression.format(row='OLD')) for column, _, expression in keys)
+        decrement.append('UPDATE %s SET qso_count = qso_count - 1 WHERE %s;' % (table, where))
+        decrement.append('DELETE FROM %s WHERE %s AND qso_count <= 0;' % (table, where))
+    version = ['UPDATE qso_log_version SET version = version + 1;']
+
+    # new rows are found by rowid, so an insert is only logged if it reused the rowid of a deleted row.
+    change_columns = 'row_id, change, timestamp, band_id, mode_id, operator_id, station_id, section'
+    change_values = '{row}.rowid, %d, {row}.timestamp, {row}.band_id, {row}.mode_id, ' \
+                    '{row}.operator_id, {row}.station_id, {row}.section'
+    log_old = ['INSERT INTO qso_log_changes (%s) VALUES (%s);' % (change_columns,
+                                                                 (change_values % -1).format(row='OLD'))]
+    log_new = ['INSERT INTO qso_log_changes (%s) VALUES (%s);' % (change_columns,
+                                                                 (change_values % 1).format(row='NEW'))]
+    log_reused = ['INSERT INTO qso_log_changes (%s) SELECT %s\n'
+                  '        WHERE NEW.rowid <= (SELECT max_deleted_rowid FROM qso_log_version WHERE id = 1);' % (
+                      change_columns, (change_values % 1).format(row='NEW'))]
+    log_deleted = ['UPDATE qso_log_version SET max_deleted_rowid = MAX(max_deleted_rowid, OLD.rowid);']
+
+    for trigger, event, statements in (('qso_log_insert_counts', 'INSERT', increment + log_reused + version),
+                                       ('qso_log_delete_counts', 'DELETE',
+                                        decrement + log_old + log_deleted + version),
+                                       ('qso_log_update_counts', 'UPDATE',
+                                        decrement + increment + log_old + log_new + version)):
+        cursor.execute('DROP TRIGGER IF EXISTS %s;' % trigger)
+        cursor.execute('CREATE TRIGGER %s AFTER %s ON qso_log\n'
+                       'BEGIN\n'
+                       '    %s\n'
+                       'END;' % (trigger, event, '\n    '.join(statements)))
+
+    if rebuild:
+        rebuild_aggregates(db, cursor)
+
+
+def rebuild_aggregates(db, cursor):
+    """
+    recount all the counter tables from qso_log.
+    """
+    logging.info('rebuilding QSO counts')
+    for table, keys in AGGREGATES:
+        expressions = ', '.join(expression.format(row='qso_log') for _, _, expression in keys)
+        cursor.execute('DELETE FROM %s;' % table)
+        cursor.execute('INSERT INTO %s (%s, qso_count)\n'
+                       'SELECT %s, COUNT(*) FROM qso_log GROUP BY %s;' % (
+                           table, ', '.join(column for column, _, _ in keys), expressions, expressions))
+    cursor.execute('UPDATE qso_log_version SET version = version + 1;')
+    db.commit()
+
+
+def get_qso_log_version(cursor):
+    """
+    return the qso_log change counter.  it goes up every time a contact is added, changed or deleted.
+    """
+    cursor.execute('SELECT version FROM qso_log_version WHERE id = 1;')
+    row = cursor.fetchone()
+    return 0 if row is None else row[0]
+
+
+def prune_changes(db, keep):
+    """
+    delete all but the newest keep qso_log_changes rows.
+    a reader that falls further behind than this rebuilds its counts from qso_log.
+    """
+    cursor = db.cursor()
+    try:
+        cursor.execute('DELETE FROM qso_log_changes WHERE seq <= (SELECT MAX(seq) FROM qso_log_changes) - ?;',
+                       (keep,))
+        db.commit()
+    except Exception as e:
+        logging.exception('Exception pruning qso_log_changes.')
+    finally:
+        cursor.close()
+
+
+INSERT_CONTACT_SQL = ('insert or ignore into qso_log \n'
+                      '    (timestamp, mycall, band_id, mode_id, operator_id, station_id , rx_freq, tx_freq, \n'
+                      '     callsign, rst_sent, rst_recv, exchange, section, comment)\n'
+                      '    values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)')  # duplicates are ignored
+UPSERT_CONTACT_SQL = ('insert into qso_log \n'
+                      '    (timestamp, mycall, band_id, mode_id, operator_id, station_id , rx_freq, tx_freq, \n'
+                      '     callsign, rst_sent, rst_recv, exchange, section, comment)\n'
+                      '    values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)\n'
+                      '    on conflict (timestamp, station_id, callsign) do update set \n'
+                      '    mycall = excluded.mycall, band_id = excluded.band_id, mode_id = excluded.mode_id, \n'
+                      '    operator_id = excluded.operator_id, rx_freq = excluded.rx_freq, tx_freq = excluded.tx_freq, \n'
+                      '    rst_sent = excluded.rst_sent, rst_recv = excluded.rst_recv, exchange = excluded.exchange, \n'
+                      '    section = excluded.section, comment = excluded.comment')
+DELETE_CONTACT_SQL = 'delete from qso_log where timestamp = ? and station_id = ? and callsign = ?'
+
+
+def make_contact_row(operators, stations,
+                     timestamp, mycall, band, mode, operator, station,
+                     rx_freq, tx_freq, callsign, rst_sent, rst_recv,
+                     exchange, section, comment):
+    """
+    convert the results of a contact_message into a qso_log row
     """
     band_id = constants.Bands.get_band_number(band)
     mode_id = constants.Modes.get_mode_number(mode)
@@ -74,46 +314,109 @@ def record_contact(db, cursor, operators, stations,
         station, rx_freq, tx_freq, callsign, rst_sent,
         rst_recv, exchange, section, comment))
 
-    cursor.execute(
-        'insert into qso_log \n'
-        '    (timestamp, mycall, band_id, mode_id, operator_id, station_id , rx_freq, tx_freq, \n'
-        '     callsign, rst_sent, rst_recv, exchange, section, comment)\n'
-        '    values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
-        (calendar.timegm(timestamp), mycall, band_id, mode_id, operator_id, station_id, rx_freq, tx_freq,
-         callsign, rst_sent, rst_recv, exchange, section, comment))
+    return (calendar.timegm(timestamp), mycall, band_id, mode_id, operator_id, station_id, rx_freq, tx_freq,
+            callsign, rst_sent, rst_recv, exchange, section, comment)
 
+
+def record_contact(db, cursor, operators, stations,
+                   timestamp, mycall, band, mode, operator, station,
+                   rx_freq, tx_freq, callsign, rst_sent, rst_recv,
+                   exchange, section, comment):
+    """
+    record the results of a contact_message
+    """
+    cursor.execute(INSERT_CONTACT_SQL, make_contact_row(operators, stations,
+                                                        timestamp, mycall, band, mode, operator, station,
+                                                        rx_freq, tx_freq, callsign, rst_sent, rst_recv,
+                                                        exchange, section, comment))
     db.commit()
 
 
-def delete_contact(db, cursor, timestamp, station, callsign):
+def record_contacts(db, cursor, rows):
     """
-    Delete the results of a delete in N1MM
+    record a batch of qso_log rows from make_contact_row in one transaction.
+    if the batch fails it is rolled back and written again a row at a time, so one bad row loses only itself.
+    """
+    failed = 0
+    try:
+        cursor.executemany(INSERT_CONTACT_SQL, rows)
+        written = cursor.rowcount
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logging.exception('Exception writing contacts to db, writing them one at a time.')
+        written = 0
+        try:
+            for row in rows:
+                try:
+                    cursor.execute(INSERT_CONTACT_SQL, row)
+                    written += cursor.rowcount
+                except Exception as e:  # sqlite3.Error, or OverflowError binding a number too big for sqlite
+                    failed += 1
+                    logging.error('Could not write contact %s at %s to db: %s', row[8], row[0], e)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logging.exception('Exception writing contacts to db.')
+            return
+        if failed:
+            logging.warning('%d of %d contacts could not be written', failed, len(rows))
+    if written + failed < len(rows):
+        logging.info('%d duplicate contacts ignored', len(rows) - written - failed)
+
+
+def replace_contact(db, cursor, row, old_timestamp=None, old_callsign=None):
+    """
+    record the results of a contactreplace message.
+    row is from make_contact_row, and replaces the contact with the same timestamp, station and callsign.
+    if the edit changed the timestamp or callsign, the contact with the old values is deleted.
     """
+    if db.in_transaction:
+        # rows already written for this contact, like a new operator or station, must not be rolled back with it.
+        db.commit()
+    try:
+        if old_timestamp is not None and old_callsign is not None:
+            old_timestamp = calendar.timegm(old_timestamp)
+            if old_timestamp != row[0] or old_callsign != row[8]:
+                cursor.execute(DELETE_CONTACT_SQL, (old_timestamp, row[5], old_callsign))
+        cursor.execute(UPSERT_CONTACT_SQL, row)
+        db.commit()
+    except Exception as e:
+        # the delete of the old contact must not be committed without its replacement.
+        db.rollback()
+        logging.exception('Exception replacing contact in db.')
 
-    """ station_id = stations.lookup_station_id(station)
-"""
 
-    logging.info('DELETEQSO: %s, timestamp = %s' % (callsign, calendar.timegm(timestamp)))
+def delete_contact(db, cursor, timestamp, station_id, callsign):
+    """
+    Delete the results of a delete in N1MM
+    station_id may be None if the station is not known.
+    """
+    timestamp = calendar.timegm(timestamp)
+    logging.info('DELETEQSO: %s, timestamp = %s' % (callsign, timestamp))
     try:
-        cursor.execute(
-            "delete from qso_log where callsign = ? and timestamp = ?", (callsign, calendar.timegm(timestamp),))
+        if station_id is None:
+            cursor.execute('delete from qso_log where timestamp = ? and callsign = ?', (timestamp, callsign))
+        else:
+            cursor.execute(DELETE_CONTACT_SQL, (timestamp, station_id, callsign))
         db.commit()
     except Exception as e:
+        db.rollback()
         logging.exception('Exception deleting contact from db.')
         return ''
 
 
 def get_last_qso(cursor) :
     cursor.execute('SELECT timestamp, callsign, exchange, section, operator.name, band_id \n'
-                   'FROM qso_log JOIN operator WHERE operator.id = operator_id \n'
-                   'ORDER BY timestamp DESC LIMIT 1')
+                   'FROM qso_log JOIN operator ON operator.id = operator_id \n'
+                   'WHERE timestamp = (SELECT MAX(timestamp) FROM qso_log) LIMIT 1;')
     last_qso_time = int(time.time()) - 60
     message = ''
     for row in cursor:
         last_qso_time = row[0]
-    message = 'Last QSO: %s %s %s on %s by %s at %s' % (
-        row[1], row[2], row[3], constants.Bands.BANDS_TITLE[row[5]], row[4],
-        datetime.utcfromtimestamp(row[0]).strftime('%H:%M:%S'))
+        message = 'Last QSO: %s %s %s on %s by %s at %s' % (
+            row[1], row[2], row[3], constants.Bands.BANDS_TITLE[row[5]], row[4],
+            datetime.utcfromtimestamp(row[0]).strftime('%H:%M:%S'))
     logging.debug(message)
     return last_qso_time, message
 
@@ -121,19 +424,19 @@ def get_last_qso(cursor) :
 def get_operators_by_qsos(cursor):
     logging.debug('Load QSOs by Operator')
     qso_operators = []
-    cursor.execute('SELECT name, COUNT(operator_id) AS qso_count \n'
-                   'FROM qso_log JOIN operator ON operator.id = operator_id \n'
-                   'GROUP BY operator_id ORDER BY qso_count DESC;')
+    cursor.execute('SELECT name, qso_count \n'
+                   'FROM qso_count_by_operator JOIN operator ON operator.id = operator_id;')
     for row in cursor:
         qso_operators.append((row[0], row[1]))
+    qso_operators.sort(key=lambda operator_qsos: operator_qsos[1], reverse=True)
     return qso_operators
 
 
 def get_station_qsos(cursor):
     logging.debug('Load QSOs by Station')
     qso_stations = []
-    cursor.execute('SELECT name, COUNT(station_id) AS qso_count \n'
-                   'FROM qso_log JOIN station ON station.id = station_id GROUP BY station_id;')
+    cursor.execute('SELECT name, qso_count \n'
+                   'FROM qso_count_by_station JOIN station ON station.id = station_id;')
     for row in cursor:
         qso_stations.append((row[0], row[1]))
     return qso_stations
@@ -145,13 +448,14 @@ def get_qsos_per_hour_per_operator(cursor, last_qso_time):
     slices_per_hour = 60 / slice_minutes
     start_time = last_qso_time - slice_minutes * 60
 
-    cursor.execute('SELECT operator.name, COUNT(operator_id) qso_count FROM qso_log\n'
-                   'JOIN operator ON operator.id = operator_id\n'
-                   'WHERE timestamp >= ? AND timestamp <= ?\n'
-                   'GROUP BY operator_id ORDER BY qso_count DESC LIMIT 10;', (start_time, last_qso_time))
+    # one index range per operator, instead of grouping and sorting the whole window.
+    cursor.execute('SELECT name, (SELECT COUNT(*) FROM qso_log\n'
+                   '              WHERE operator_id = operator.id AND timestamp >= ? AND timestamp <= ?) AS qso_count\n'
+                   'FROM operator;', (start_time, last_qso_time))
+    rows = sorted((row for row in cursor if row[1] > 0), key=lambda row: row[1], reverse=True)[:10]
     operator_qso_rates = [['Operator', 'Rate']]
     total = 0
-    for row in cursor:
+    for row in rows:
         rate = row[1] * slices_per_hour
         total += rate
         operator_qso_rates.append([row[0], '%4d' % rate])
@@ -159,47 +463,262 @@ def get_qsos_per_hour_per_operator(cursor, last_qso_time):
     return operator_qso_rates
 
 
+def make_rates_table(title, named_rates, windows):
+    """
+    make the QSO rates table from (name, [rate for each window]) pairs, busiest first, with a total.
+    """
+    table = [[title] + ['%dm' % window for window in windows]]
+    totals = [sum(window_rates) for window_rates in zip(*[item[1] for item in named_rates])] or [0] * len(windows)
+    for name, window_rates in sorted(named_rates, key=lambda item: item[1], reverse=True)[:10]:
+        table.append([name] + ['%4d' % rate for rate in window_rates])
+    table.append(['Total'] + ['%4d' % total for total in totals])
+    return table
+
+
 def get_qso_band_modes(cursor):
     qso_band_modes = [[0] * 4 for _ in constants.Bands.BANDS_LIST]
 
-    cursor.execute('SELECT COUNT(*), band_id, mode_id FROM qso_log GROUP BY band_id, mode_id;')
+    cursor.execute('SELECT qso_count, band_id, mode_id FROM qso_count_by_band_mode;')
     for row in cursor:
-        qso_band_modes[row[1]][constants.Modes.MODE_TO_SIMPLE_MODE[row[2]]] = row[0]
+        qso_band_modes[row[1]][constants.Modes.MODE_TO_SIMPLE_MODE[row[2]]] += row[0]
     return qso_band_modes
 
 
 def get_qsos_per_hour_per_band(cursor):
-    qsos_per_hour = []
-    qsos_by_band = [0] * constants.Bands.count()
-    slice_minutes = 15
-    slices_per_hour = 60 / slice_minutes
-    window_seconds = slice_minutes * 60
-
     logging.debug('Load QSOs per Hour by Band')
-    cursor.execute('SELECT timestamp / %d * %d AS ts, band_id, COUNT(*) AS qso_count \n'
-                   'FROM qso_log GROUP BY ts, band_id;' % (window_seconds, window_seconds))
-    for row in cursor:
-        if len(qsos_per_hour) == 0:
-            qsos_per_hour.append([0] * constants.Bands.count())
-            qsos_per_hour[-1][0] = row[0]
-        while qsos_per_hour[-1][0] != row[0]:
-            ts = qsos_per_hour[-1][0] + window_seconds
-            qsos_per_hour.append([0] * constants.Bands.count())
-            qsos_per_hour[-1][0] = ts
-        qsos_per_hour[-1][row[1]] = row[2] * slices_per_hour
-        qsos_by_band[row[1]] += row[2]
+    cursor.execute('SELECT %s AS ts, band_id, SUM(qso_count) AS qso_count \n'
+                   'FROM qso_count_by_minute_band GROUP BY ts, band_id;' % minute_bucket_expression())
+    rows = rows_to_array(cursor.fetchall(), 3)
+    return make_qsos_per_hour_per_band(rows[:, 0], rows[:, 1], rows[:, 2])
 
-    for rec in qsos_per_hour:  # FIXME
-        rec[0] = datetime.utcfromtimestamp(rec[0])
-        t = rec[0].strftime('%H:%M:%S')
 
-    return qsos_per_hour, qsos_by_band
+def rows_to_array(rows, columns):
+    """
+    convert a list of integer row tuples to a rows x columns numpy array
+    """
+    return np.fromiter(itertools.chain.from_iterable(rows), dtype=np.int64,
+                       count=len(rows) * columns).reshape(-1, columns)
+
+
+def make_qsos_per_hour_per_band(timestamps, band_ids, counts):
+    """
+    make the QSO rate by band series from arrays of timestamps, band_ids and qso counts.
+    the counts are summed into config.RATE_BUCKET_MINUTES buckets, with empty buckets filled in.
+    returns ((bucket start times in seconds, buckets x bands array of QSOs per hour), qsos by band)
+    """
+    bucket_seconds = config.RATE_BUCKET_MINUTES * 60
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    band_ids = np.asarray(band_ids, dtype=np.intp)
+    counts = np.asarray(counts, dtype=np.int64)
+    qsos_by_band = np.bincount(band_ids, weights=counts, minlength=constants.Bands.count()).astype(np.int64)
+    if len(timestamps) == 0:
+        return (np.zeros(0, dtype=np.int64), np.zeros((0, constants.Bands.count()))), qsos_by_band.tolist()
+
+    first = timestamps.min() // bucket_seconds * bucket_seconds
+    buckets = (timestamps - first) // bucket_seconds
+    rates = np.bincount(buckets * constants.Bands.count() + band_ids, weights=counts,
+                        minlength=(buckets.max() + 1) * constants.Bands.count())
+    rates = rates.reshape(-1, constants.Bands.count()) * (3600.0 / bucket_seconds)
+    bucket_times = first + np.arange(len(rates), dtype=np.int64) * bucket_seconds
+    return (bucket_times, rates), qsos_by_band.tolist()
 
 
 def get_qsos_by_section(cursor):
     logging.debug('Load QSOs by Section')
     qsos_by_section = {}
-    cursor.execute('SELECT section, COUNT(section) AS qsos FROM qso_log GROUP BY section;')
+    cursor.execute('SELECT section, qso_count FROM qso_count_by_section;')
     for row in cursor:
         qsos_by_section[row[0]] = row[1]
     return qsos_by_section
+
+
+class StatsSnapshot:
+    """
+    all the statistics the charts are drawn from, read together so they agree with each other.
+    """
+
+    def __init__(self):
+        self.version = 0
+        self.last_qso_time = 0
+        self.last_qso_message = ''
+        self.qso_operators = []
+        self.qso_stations = []
+        self.qso_band_modes = []
+        self.operator_qso_rates = []
+        self.station_rates = []  # (name, [QSOs per hour for each of config.RATE_WINDOW_MINUTES])
+        self.band_rates = []
+        self.qsos_per_hour = None  # (bucket start times, buckets x bands rates) from make_qsos_per_hour_per_band
+        self.qsos_per_band = []
+        self.qsos_by_section = {}
+
+
+def get_stats_snapshot(db):
+    """
+    read a StatsSnapshot in a single read transaction, so the collector's writes
+    cannot land between one query and the next.
+    """
+    snapshot = StatsSnapshot()
+    cursor = db.cursor()
+    try:
+        cursor.execute('BEGIN')
+        snapshot.version = get_qso_log_version(cursor)
+        snapshot.last_qso_time, snapshot.last_qso_message = get_last_qso(cursor)
+        snapshot.qso_operators = get_operators_by_qsos(cursor)
+        snapshot.qso_stations = get_station_qsos(cursor)
+        snapshot.qso_band_modes = get_qso_band_modes(cursor)
+        snapshot.operator_qso_rates = get_qsos_per_hour_per_operator(cursor, snapshot.last_qso_time)
+        snapshot.qsos_per_hour, snapshot.qsos_per_band = get_qsos_per_hour_per_band(cursor)
+        snapshot.qsos_by_section = get_qsos_by_section(cursor)
+    finally:
+        db.rollback()
+        cursor.close()
+    return snapshot
+
+
+class AggregateModel:
+    """
+    QSO counts kept in memory between refreshes.  each update reads only the qso_log rows added
+    since the last one, by rowid, and the qso_log_changes rows for contacts that were changed or deleted.
+    the counts are rebuilt from the whole log the first time, or if the changes needed were pruned.
+    QSO rates by operator, station and band come from a rates.RateEngine fed with the same rows.
+    """
+
+    def __init__(self):
+        self.version = None
+        self.rows_read = 0
+        self.rebuilds = 0
+        self.operator_names = {}
+        self.station_names = {}
+        self._clear()
+
+    def _clear(self):
+        self.last_rowid = 0
+        self.last_seq = 0
+        self.operator_counts = Counter()
+        self.station_counts = Counter()
+        self.band_mode_counts = Counter()
+        self.section_counts = Counter()
+        self.minute_band_counts = Counter()
+        self.rate_engine = rates.RateEngine()
+
+    def update(self, db):
+        """
+        catch up with the database and return a StatsSnapshot of it, all in a single read transaction.
+        """
+        snapshot = StatsSnapshot()
+        cursor = db.cursor()
+        try:
+            cursor.execute('BEGIN')
+            snapshot.version = get_qso_log_version(cursor)
+            if self.version is None or snapshot.version < self.version or self._changes_missing(cursor):
+                self._rebuild(cursor)
+            else:
+                self._apply_changes(cursor)
+            self._add_new_rows(cursor)
+            self.version = snapshot.version
+
+            snapshot.last_qso_time, snapshot.last_qso_message = get_last_qso(cursor)
+            self.operator_names = self._names(cursor, 'operator')
+            self.station_names = self._names(cursor, 'station')
+        finally:
+            db.rollback()
+            cursor.close()
+
+        snapshot.qso_operators = [(self.operator_names.get(operator_id, ''), count)
+                                  for operator_id, count in self.operator_counts.most_common() if count > 0]
+        snapshot.qso_stations = [(self.station_names.get(station_id, ''), count)
+                                 for station_id, count in self.station_counts.items() if count > 0]
+        snapshot.qso_band_modes = [[0] * 4 for _ in constants.Bands.BANDS_LIST]
+        for (band_id, mode_id), count in self.band_mode_counts.items():
+            snapshot.qso_band_modes[band_id][constants.Modes.MODE_TO_SIMPLE_MODE[mode_id]] += count
+        minute_bands = rows_to_array([(minute, band_id, count)
+                                      for (minute, band_id), count in self.minute_band_counts.items() if count > 0],
+                                     3)
+        snapshot.qsos_per_hour, snapshot.qsos_per_band = make_qsos_per_hour_per_band(
+            minute_bands[:, 0], minute_bands[:, 1], minute_bands[:, 2])
+        snapshot.qsos_by_section = {section: count for section, count in self.section_counts.items() if count > 0}
+        self.update_rates(snapshot)
+        return snapshot
+
+    def update_rates(self, snapshot, now=None):
+        """
+        bring the rates in snapshot up to the wall clock time.  no database access is needed.
+        returns True if the rates changed.
+        """
+        self.rate_engine.advance(now)
+        operator_rates = []
+        station_rates = []
+        band_rates = []
+        for kind, key_id in self.rate_engine.keys():
+            key_rates = self.rate_engine.rates((kind, key_id))
+            if not any(key_rates):
+                continue
+            if kind == 'operator':
+                operator_rates.append((self.operator_names.get(key_id, ''), key_rates))
+            elif kind == 'station':
+                station_rates.append((self.station_names.get(key_id, ''), key_rates))
+            else:
+                band_rates.append((constants.Bands.BANDS_TITLE[key_id], key_rates))
+        operator_qso_rates = make_rates_table('Operator', operator_rates, self.rate_engine.windows)
+        station_rates.sort(key=lambda named_rates: named_rates[1], reverse=True)
+        band_rates.sort(key=lambda named_rates: named_rates[1], reverse=True)
+        changed = (operator_qso_rates != snapshot.operator_qso_rates or station_rates != snapshot.station_rates
+                   or band_rates != snapshot.band_rates)
+        snapshot.operator_qso_rates = operator_qso_rates
+        snapshot.station_rates = station_rates
+        snapshot.band_rates = band_rates
+        return changed
+
+    def _count(self, change, timestamp, band_id, mode_id, operator_id, station_id, section):
+        self.operator_counts[operator_id] += change
+        self.station_counts[station_id] += change
+        self.band_mode_counts[(band_id, mode_id)] += change
+        self.section_counts['' if section is None else section] += change
+        self.minute_band_counts[(timestamp // 60 * 60, band_id)] += change
+        self.rate_engine.add(('operator', operator_id), timestamp, change)
+        self.rate_engine.add(('station', station_id), timestamp, change)
+        self.rate_engine.add(('band', band_id), timestamp, change)
+
+    def _changes_missing(self, cursor):
+        """
+        True if qso_log_changes rows this model has not seen have been pruned.
+        """
+        cursor.execute('SELECT MIN(seq) FROM qso_log_changes;')
+        first_seq = cursor.fetchone()[0]
+        if first_seq is not None:
+            return first_seq > self.last_seq + 1
+        cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'qso_log_changes';")
+        row = cursor.fetchone()
+        return row is not None and row[0] > self.last_seq
+
+    def _rebuild(self, cursor):
+        logging.info('loading all QSO counts')
+        self._clear()
+        self.rebuilds += 1
+        cursor.execute('SELECT MAX(seq) FROM qso_log_changes;')
+        self.last_seq = cursor.fetchone()[0] or 0
+
+    def _apply_changes(self, cursor):
+        """
+        apply the logged changes to rows already counted.  changes to newer rows are skipped,
+        _add_new_rows reads their current values.
+        """
+        cursor.execute('SELECT seq, row_id, change, timestamp, band_id, mode_id, operator_id, station_id, section\n'
+                       'FROM qso_log_changes WHERE seq > ? ORDER BY seq;', (self.last_seq,))
+        for row in cursor:
+            if row[1] <= self.last_rowid:
+                self._count(*row[2:])
+            self.last_seq = row[0]
+
+    def _add_new_rows(self, cursor):
+        cursor.execute('SELECT rowid, timestamp, band_id, mode_id, operator_id, station_id, section\n'
+                       'FROM qso_log WHERE rowid > ? ORDER BY rowid;', (self.last_rowid,))
+        for row in cursor:
+            self._count(1, *row[1:])
+            self.last_rowid = row[0]
+            self.rows_read += 1
+
+    @staticmethod
+    def _names(cursor, table):
+        cursor.execute('SELECT id, name FROM %s;' % table)
+        return dict(cursor.fetchall())
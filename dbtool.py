@@ -0,0 +1,50 @@
+#!/usr/bin/python3
+"""
+n1mm_view database tool
+maintenance commands for the n1mm_view database.
+"""
+
+import argparse
+import logging
+import time
+
+import config
+import dataaccess
+
+__author__ = 'Jeffrey B. Otterson, N1KDO'
+__copyright__ = 'Copyright 2016, 2017, 2019 Jeffrey B. Otterson'
+__license__ = 'Simplified BSD'
+
+logging.basicConfig(format='%(asctime)s.%(msecs)03d %(levelname)-8s %(message)s', datefmt='%Y-%m-%d %H:%M:%S',
+                    level=config.LOG_LEVEL)
+logging.Formatter.converter = time.gmtime
+
+
+def rebuild_aggregates(db, cursor, args):
+    """
+    recount the QSO counter tables from qso_log
+    """
+    dataaccess.rebuild_aggregates(db, cursor)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='n1mm_view database maintenance')
+    parser.add_argument('--database', default=config.DATABASE_FILENAME, help='database file name')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+    command = subparsers.add_parser('rebuild-aggregates', help='recount the QSO counter tables from qso_log')
+    command.set_defaults(function=rebuild_aggregates)
+    args = parser.parse_args()
+
+    db = dataaccess.open_database(args.database)
+    cursor = db.cursor()
+    try:
+        dataaccess.create_tables(db, cursor)
+        args.function(db, cursor, args)
+    finally:
+        cursor.close()
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
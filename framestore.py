@@ -0,0 +1,104 @@
+# n1mm_view shared memory frame store
+# hands the chart images from the chart engine process to the dashboard display without copying them through a queue.
+
+import logging
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # python 3.7
+    shared_memory = None
+
+__author__ = 'Jeffrey B. Otterson, N1KDO'
+__copyright__ = 'Copyright 2016, 2017, 2019 Jeffrey B. Otterson'
+__license__ = 'Simplified BSD'
+
+# each slot's header is generation, newest buffer, buffer in use by the display, width, height
+HEADER_FIELDS = 5
+GENERATION = 0
+NEWEST = 1
+IN_USE = 2
+WIDTH = 3
+HEIGHT = 4
+
+
+class FrameStore:
+    """
+    a block of shared memory with a slot for each image, and two frame buffers in each slot.
+    the chart engine writes a new frame into the buffer the display is not using, then sends the slot number
+    through the queue.  the display takes the newest frame and shows it straight from the shared memory, so
+    the writer has to stay off that buffer until the display takes another.
+    the display process makes the store with name None, and passes name to the chart engine process.
+    """
+
+    def __init__(self, slots, frame_bytes, lock, name=None):
+        self.slots = slots
+        self.frame_bytes = frame_bytes
+        self.lock = lock
+        self.header_bytes = slots * HEADER_FIELDS * 8
+        self.owner = name is None
+        if self.owner:
+            self.memory = shared_memory.SharedMemory(create=True, size=self.header_bytes + slots * 2 * frame_bytes)
+            logging.debug('created %d byte frame store %s', self.memory.size, self.memory.name)
+        else:
+            self.memory = shared_memory.SharedMemory(name=name)
+        self.name = self.memory.name
+        self.header = self.memory.buf[:self.header_bytes].cast('q')
+        if self.owner:
+            for slot in range(slots):
+                self.set(slot, GENERATION, 0)
+                self.set(slot, NEWEST, -1)
+                self.set(slot, IN_USE, -1)
+
+    def get(self, slot, field):
+        return self.header[slot * HEADER_FIELDS + field]
+
+    def set(self, slot, field, value):
+        self.header[slot * HEADER_FIELDS + field] = value
+
+    def buffer(self, slot, buffer, length):
+        offset = self.header_bytes + (slot * 2 + buffer) * self.frame_bytes
+        return self.memory.buf[offset:offset + length]
+
+    def write(self, slot, image_data, image_size):
+        """
+        store an RGB frame in slot, return its generation, or None if it does not fit.
+        """
+        if len(image_data) > self.frame_bytes:
+            return None
+        with self.lock:
+            buffer = 1 if self.get(slot, IN_USE) == 0 else 0
+            frame = self.buffer(slot, buffer, len(image_data))
+            frame[:] = image_data
+            frame.release()
+            generation = self.get(slot, GENERATION) + 1
+            self.set(slot, GENERATION, generation)
+            self.set(slot, NEWEST, buffer)
+            self.set(slot, WIDTH, image_size[0])
+            self.set(slot, HEIGHT, image_size[1])
+        return generation
+
+    def read(self, slot):
+        """
+        take the newest frame in slot for display, return (its data, its size), or None if it was already taken.
+        the data is a view of the shared memory, good until the next read of the slot.
+        """
+        with self.lock:
+            if self.get(slot, NEWEST) < 0:
+                return None
+            buffer = self.get(slot, NEWEST)
+            self.set(slot, IN_USE, buffer)
+            self.set(slot, NEWEST, -1)
+            size = (self.get(slot, WIDTH), self.get(slot, HEIGHT))
+        return self.buffer(slot, buffer, size[0] * size[1] * 3), size
+
+    def close(self):
+        """
+        detach from the shared memory, and free it if this process made it.
+        everything made from the frames read must be gone first, but the memory is freed even if it is not.
+        """
+        try:
+            self.header.release()
+            self.memory.close()
+        finally:
+            if self.owner:
+                self.memory.unlink()
@@ -0,0 +1,143 @@
+#!/usr/bin/python3
+"""
+n1mm_view synthetic contest database generator
+makes a n1mm_view database full of made up QSOs, for measuring how the
+database code scales.  the number of QSOs, operators and stations, the band and
+mode mix and how lopsided the sections are can all be set.
+stations change bands every few hours, operators work in shifts, and the rate
+drops overnight, like a real field day.
+"""
+
+import argparse
+import calendar
+import logging
+import os
+import random
+import time
+from datetime import datetime
+
+import constants
+import dataaccess
+
+__author__ = 'Jeffrey B. Otterson, N1KDO'
+__copyright__ = 'Copyright 2016, 2017, 2019 Jeffrey B. Otterson'
+__license__ = 'Simplified BSD'
+
+logging.basicConfig(format='%(asctime)s.%(msecs)03d %(levelname)-8s %(message)s', datefmt='%Y-%m-%d %H:%M:%S',
+                    level=logging.INFO)
+logging.Formatter.converter = time.gmtime
+
+INSERT_BATCH_SIZE = 10000
+SHIFT_HOURS = 2
+NIGHT_HOURS_UTC = range(5, 11)
+NIGHT_RATE = 0.4
+
+
+def parse_mix(text, names):
+    """
+    parse a 'name:weight,name:weight' list, return (names, weights)
+    """
+    choices = []
+    weights = []
+    for item in text.split(','):
+        name, weight = item.split(':')
+        if name not in names:
+            raise argparse.ArgumentTypeError('unknown name %s, must be one of %s' % (name, ', '.join(names)))
+        choices.append(name)
+        weights.append(float(weight))
+    return choices, weights
+
+
+def make_callsign():
+    letters = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+    return '%s%d%s' % (random.choice(['K', 'N', 'W', 'AA', 'KB', 'KD', 'VE']), random.randint(0, 9),
+                       ''.join(random.choice(letters) for _ in range(random.randint(1, 3))))
+
+
+def make_timestamps(qsos, start, hours):
+    """
+    make sorted QSO times over the contest, fewer at night.
+    """
+    hour_weights = [NIGHT_RATE if (start // 3600 + hour) % 24 in NIGHT_HOURS_UTC else 1.0 for hour in range(hours)]
+    hour_choices = random.choices(range(hours), weights=hour_weights, k=qsos)
+    return sorted(start + hour * 3600 + random.randrange(3600) for hour in hour_choices)
+
+
+def make_rows(args):
+    """
+    generate the qso_log rows
+    """
+    bands, band_weights = parse_mix(args.bands, constants.Bands.BANDS_LIST)
+    modes, mode_weights = parse_mix(args.modes, constants.Modes.MODES_LIST)
+    sections = list(constants.CONTEST_SECTIONS.keys())
+    random.shuffle(sections)
+    section_weights = [1.0 / (rank + 1) ** args.section_skew for rank in range(len(sections))]
+    start = calendar.timegm(datetime.strptime(args.start, '%Y-%m-%d %H:%M:%S').timetuple())
+
+    # each station is on one band for a couple of hours at a time.
+    slots = args.hours // SHIFT_HOURS + 1
+    station_bands = [random.choices(bands, weights=band_weights, k=slots) for _ in range(args.stations)]
+
+    for timestamp in make_timestamps(args.qsos, start, args.hours):
+        station = random.randrange(args.stations)
+        shift = (timestamp - start) // (SHIFT_HOURS * 3600)
+        operator = (station + shift * args.stations) % args.operators
+        band = station_bands[station][shift]
+        freq = int(float(band) * 100000) + random.randrange(20000)
+        mode = random.choices(modes, weights=mode_weights)[0]
+        rst = '599' if constants.Modes.get_simple_mode_number(mode) != 2 else '59'
+        yield (timestamp, args.mycall, constants.Bands.get_band_number(band), constants.Modes.get_mode_number(mode),
+               operator + 1, station + 1, freq, freq, make_callsign(), rst, rst,
+               '%d%s' % (random.randint(1, 20), random.choice('ABCDEF')),
+               random.choices(sections, weights=section_weights)[0], '')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='generate a synthetic n1mm_view contest database')
+    parser.add_argument('database', help='database file to create')
+    parser.add_argument('--qsos', type=int, default=100000, help='number of QSOs, try 10000, 100000 or 1000000')
+    parser.add_argument('--operators', type=int, default=20, help='number of operators')
+    parser.add_argument('--stations', type=int, default=6, help='number of stations')
+    parser.add_argument('--hours', type=int, default=24, help='length of the contest in hours')
+    parser.add_argument('--start', default='2019-06-22 18:00:00', help='contest start time, UTC')
+    parser.add_argument('--bands', default='3.5:15,7:30,14:30,21:12,28:5,1.8:3,50:5',
+                        help='band mix, as band:weight,...')
+    parser.add_argument('--modes', default='CW:40,USB:25,LSB:15,FT8:15,RTTY:5', help='mode mix, as mode:weight,...')
+    parser.add_argument('--section-skew', type=float, default=1.0,
+                        help='how lopsided the sections are, 0 is even, bigger favors a few sections')
+    parser.add_argument('--mycall', default='N4N', help='the station call')
+    parser.add_argument('--seed', type=int, default=1, help='random seed, the same seed makes the same database')
+    args = parser.parse_args()
+
+    if os.path.exists(args.database):
+        parser.error('%s already exists' % args.database)
+    random.seed(args.seed)
+    db = dataaccess.open_database(args.database)
+    cursor = db.cursor()
+    dataaccess.create_tables(db, cursor)
+    cursor.executemany('INSERT INTO operator (id, name) VALUES (?, ?);',
+                       [(i + 1, 'OP%02d' % (i + 1)) for i in range(args.operators)])
+    cursor.executemany('INSERT INTO station (id, name) VALUES (?, ?);',
+                       [(i + 1, 'STATION-%d' % (i + 1)) for i in range(args.stations)])
+    db.commit()
+
+    t0 = time.time()
+    batch = []
+    for row in make_rows(args):
+        batch.append(row)
+        if len(batch) == INSERT_BATCH_SIZE:
+            cursor.executemany(dataaccess.INSERT_CONTACT_SQL, batch)
+            db.commit()
+            batch = []
+    cursor.executemany(dataaccess.INSERT_CONTACT_SQL, batch)
+    db.commit()
+
+    cursor.execute('SELECT COUNT(*) FROM qso_log;')
+    logging.info('%s has %d QSOs, made in %.1f seconds', args.database, cursor.fetchone()[0], time.time() - t0)
+    dataaccess.checkpoint(db, 'TRUNCATE')
+    cursor.close()
+    db.close()
+
+
+if __name__ == '__main__':
+    main()
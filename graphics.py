@@ -2,7 +2,10 @@
 #
 #
 import calendar
+import hashlib
 import os
+import time
+from collections import OrderedDict
 
 import cartopy.crs as ccrs
 import cartopy.feature as cfeature
@@ -12,7 +15,9 @@ import matplotlib.backends.backend_agg as agg
 import matplotlib.pyplot as plt
 import numpy as np
 import pygame
+from matplotlib.collections import PathCollection
 from matplotlib.dates import HourLocator, DateFormatter
+from matplotlib.path import Path
 
 from config import *
 from constants import *
@@ -39,8 +44,124 @@ view_font = pygame.font.Font('VeraMoBd.ttf', 64)
 bigger_font = pygame.font.SysFont('VeraMoBd.ttf', 180)
 view_font_height = view_font.get_height()
 
+
+def chart_inputs(*inputs, every=None):
+    """
+    declare the dataaccess.StatsSnapshot fields a chart function is drawn from, in the order it takes them after size.
+    a chart that also changes with time, like the gray line on the map, is drawn again every so many seconds.
+    the chart engine only draws a chart again when one of these has changed.
+    """
+    def declare(function):
+        function.inputs = inputs
+        function.every = every
+        return function
+    return declare
+
+
+class TextCache:
+    """
+    rendered text surfaces and text sizes, keyed by font, text and color, least recently used dropped first.
+    in a fixed width font, numbers are put together from a rendering of each of their characters, the digit
+    atlas, so a changed number costs some blits instead of a font render.
+    """
+
+    atlas_characters = '0123456789 ,.-'
+
+    def __init__(self, max_entries=TEXT_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.surfaces = OrderedDict()
+        self.sizes = OrderedDict()
+        self.fixed_width_fonts = {}
+        self.atlases = {}
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, cache, key):
+        value = cache.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            cache.move_to_end(key)
+        return value
+
+    def store(self, cache, key, value):
+        cache[key] = value
+        if len(cache) > self.max_entries:
+            cache.popitem(last=False)
+
+    def use_atlas(self, font, text):
+        """
+        return True if text is a number, and font draws it the same one character at a time.
+        """
+        if not any(c.isdigit() for c in text) or not all(c in self.atlas_characters for c in text):
+            return False
+        fixed_width = self.fixed_width_fonts.get(font)
+        if fixed_width is None:
+            fixed_width = font.size(self.atlas_characters)[0] == sum(font.size(c)[0] for c in self.atlas_characters)
+            self.fixed_width_fonts[font] = fixed_width
+        return fixed_width
+
+    def atlas(self, font, color):
+        """
+        return {character: surface} of the atlas characters in font and color
+        """
+        key = (font, color)
+        atlas = self.atlases.get(key)
+        if atlas is None:
+            atlas = {c: font.render(c, True, color) for c in self.atlas_characters}
+            self.atlases[key] = atlas
+        return atlas
+
+    def size(self, font, text):
+        """
+        return the (width, height) of text in font, as render would make it
+        """
+        key = (font, text)
+        text_size = self.lookup(self.sizes, key)
+        if text_size is None:
+            if self.use_atlas(font, text):
+                text_size = (font.size('0')[0] * len(text), font.get_height())
+            else:
+                text_size = font.size(text)
+            self.store(self.sizes, key, text_size)
+        return text_size
+
+    def render(self, font, text, color):
+        """
+        return a surface with text drawn in font and color on a transparent background
+        """
+        color = tuple(color)
+        key = (font, text, color)
+        surface = self.lookup(self.surfaces, key)
+        if surface is None:
+            if self.use_atlas(font, text):
+                atlas = self.atlas(font, color)
+                surface = pygame.Surface(self.size(font, text), pygame.SRCALPHA)
+                x = 0
+                for c in text:
+                    # the glyphs do not overlap, max copies them onto the transparent surface as they are.
+                    surface.blit(atlas[c], (x, 0), special_flags=pygame.BLEND_RGBA_MAX)
+                    x += atlas[c].get_width()
+            else:
+                surface = font.render(text, True, color)
+            self.store(self.surfaces, key, surface)
+        return surface
+
+
+text_cache = TextCache()
+
 _map = None
 
+""" longitudes and latitudes of the section map's edges """
+MAP_EXTENT = (-168, -52, 10, 60)
+""" change this when the section map rendering changes, so the cached maps are made again """
+MAP_RASTER_VERSION = 2
+""" how far below the horizon, in degrees, the sun is when the map is fully shaded for night """
+TWILIGHT_DEGREES = 12
+""" how much the map is darkened at night, out of 256 """
+NIGHT_SHADE = 128
+
 
 def init_display():
     """
@@ -138,6 +259,7 @@ def make_pie(size, values, labels, title):
     return raw_data, canvas_size
 
 
+@chart_inputs('qso_operators')
 def qso_operators_graph(size, qso_operators):
     """
     create the QSOs by Operators pie chart
@@ -153,6 +275,7 @@ def qso_operators_graph(size, qso_operators):
     return make_pie(size, values, labels, "QSOs by Operator")
 
 
+@chart_inputs('qso_operators')
 def qso_operators_table(size, qso_operators):
     """
     create the Top 5 QSOs by Operators table
@@ -174,6 +297,7 @@ def qso_operators_table(size, qso_operators):
         return draw_table(size, cells, "Top 5 Operators", bigger_font)
 
 
+@chart_inputs('qso_stations')
 def qso_stations_graph(size, qso_stations):
     """
     create the QSOs by Station pie chart
@@ -189,6 +313,7 @@ def qso_stations_graph(size, qso_stations):
     return make_pie(size, values, labels, "QSOs by Station")
 
 
+@chart_inputs('qso_band_modes')
 def qso_bands_graph(size, qso_band_modes):
     """
     create the QSOs by Band pie chart
@@ -214,6 +339,7 @@ def qso_bands_graph(size, qso_band_modes):
     return make_pie(size, values, labels, "QSOs by Band")
 
 
+@chart_inputs('qso_band_modes')
 def qso_modes_graph(size, qso_band_modes):
     """
     create the QSOs by Mode pie chart
@@ -278,6 +404,7 @@ def make_score_table(qso_band_modes):
     return cell_text
 
 
+@chart_inputs('qso_band_modes')
 def qso_summary_table(size, qso_band_modes):
     """
     create the QSO Summary Table
@@ -285,34 +412,31 @@ def qso_summary_table(size, qso_band_modes):
     return draw_table(size, make_score_table(qso_band_modes), "QSOs Summary")
 
 
+@chart_inputs('operator_qso_rates')
 def qso_rates_table(size, operator_qso_rates):
     """
     create the QSO Rates by Operator table
     """
-    if operator_qso_rates is None or len(operator_qso_rates) < 3:
+    if operator_qso_rates is None:
         return None, (0, 0)
-    else:
-        return draw_table(size, operator_qso_rates, "QSO/Hour Rates")
+    # with no recent QSOs there is only the total, drawn so the rates are seen to fall to zero.
+    return draw_table(size, operator_qso_rates, "QSO/Hour Rates")
 
 
+@chart_inputs('qsos_per_hour')
 def qso_rates_chart(size, qsos_per_hour):
     """
     make the qsos per hour per band chart
+    qsos_per_hour is (bucket start times, buckets x bands array of rates) from make_qsos_per_hour_per_band
     returns a pygame surface
     """
     title = 'QSOs per Hour by Band'
-    qso_counts = [[], [], [], [], [], [], [], [], [], []]
 
-    if qsos_per_hour is None or len(qsos_per_hour) == 0:
+    if qsos_per_hour is None or len(qsos_per_hour[0]) == 0:
         return None, (0, 0)
 
-    data_valid = len(qsos_per_hour) != 0
-
-    for qpm in qsos_per_hour:
-        for i in range(0, Bands.count()):
-            c = qpm[i]
-            cl = qso_counts[i]
-            cl.append(c)
+    bucket_times, rates = qsos_per_hour
+    data_valid = len(bucket_times) != 0
 
     logging.debug('make_plot(...,...,%s)', title)
     width_inches = size[0] / 100.0
@@ -327,21 +451,21 @@ def qso_rates_chart(size, qsos_per_hour):
     ax.set_title(title, color='white', size=48, weight='bold')
 
     st = calendar.timegm(EVENT_START_TIME.timetuple())
-    lt = calendar.timegm(qsos_per_hour[-1][0].timetuple())
+    lt = bucket_times[-1]
     if data_valid:
-        dates = matplotlib.dates.date2num(qso_counts[0])
+        dates = matplotlib.dates.date2num(bucket_times.astype('datetime64[s]'))
         colors = ['r', 'g', 'b', 'c', 'm', 'y', '#ff9900', '#00ff00', '#663300']
         labels = Bands.BANDS_TITLE[1:]
         if lt < st:
-            start_date = dates[0]  # matplotlib.dates.date2num(qsos_per_hour[0][0].timetuple())
-            end_date = dates[-1]  # matplotlib.dates.date2num(qsos_per_hour[-1][0].timetuple())
+            start_date = dates[0]
+            end_date = dates[-1]
         else:
             start_date = matplotlib.dates.date2num(EVENT_START_TIME)
             end_date = matplotlib.dates.date2num(EVENT_END_TIME)
         ax.set_xlim(start_date, end_date)
 
-        ax.stackplot(dates, qso_counts[1], qso_counts[2], qso_counts[3], qso_counts[4], qso_counts[5], qso_counts[6],
-                     qso_counts[7], qso_counts[8], qso_counts[9], labels=labels, colors=colors, linewidth=0.2)
+        # one row per band, skipping 'No Band'.
+        ax.stackplot(dates, rates[:, 1:].T, labels=labels, colors=colors, linewidth=0.2)
         ax.grid(True)
         legend = ax.legend(loc='best', ncol=Bands.count() - 1)
         legend.get_frame().set_color((0, 0, 0, 0))
@@ -392,7 +516,7 @@ def draw_table(size, cell_text, title, font=None):
     for row in cell_text:
         col_num = 0
         for col in row:
-            text_size = table_font.size(col)
+            text_size = text_cache.size(table_font, col)
             text_width = text_size[0] + 2 * text_x_offset
             if text_width > col_widths[col_num]:
                 col_widths[col_num] = text_width
@@ -400,7 +524,7 @@ def draw_table(size, cell_text, title, font=None):
                 widest = text_width
             col_num += 1
 
-    header_width = table_font.size(title)[0]
+    header_width = text_cache.size(table_font, title)[0]
     table_width = sum(col_widths) + line_width / 2
     row_height = table_font.get_height()
     height = (rows + 1) * row_height + line_width / 2
@@ -418,7 +542,7 @@ def draw_table(size, cell_text, title, font=None):
     grid_color = GRAY
 
     # draw the title
-    text = table_font.render(title, True, head_color)
+    text = text_cache.render(table_font, title, head_color)
     textpos = text.get_rect()
     textpos.y = 0
     textpos.centerx = surface_width / 2
@@ -457,9 +581,9 @@ def draw_table(size, cell_text, title, font=None):
             x += col_widths[column_number]
             column_number += 1
             if row_number == 1 or column_number == 1:
-                text = table_font.render(col, True, head_color)
+                text = text_cache.render(table_font, col, head_color)
             else:
-                text = table_font.render(col, True, text_color)
+                text = text_cache.render(table_font, col, text_color)
             textpos = text.get_rect()
             textpos.y = y - text_y_offset
             textpos.right = x - text_x_offset
@@ -472,58 +596,297 @@ def draw_table(size, cell_text, title, font=None):
     return data, size
 
 
-def draw_map(size, qsos_by_section):
+def geometry_to_path(geometry):
     """
-    make the choropleth with Cartopy & section shapefiles
+    convert a shapely polygon or multipolygon to a matplotlib path, holes and all.
     """
-    logging.debug('draw_section map()')
-    width_inches = size[0] / 100.0
-    height_inches = size[1] / 100.0
-    fig = plt.Figure(figsize=(width_inches, height_inches), dpi=100, facecolor='black')
+    vertices = []
+    codes = []
+    polygons = geometry.geoms if hasattr(geometry, 'geoms') else [geometry]
+    for polygon in polygons:
+        for ring in [polygon.exterior] + list(polygon.interiors):
+            ring_vertices = np.asarray(ring.coords)[:, :2]
+            ring_codes = np.full(len(ring_vertices), Path.LINETO, dtype=Path.code_type)
+            ring_codes[0] = Path.MOVETO
+            ring_codes[-1] = Path.CLOSEPOLY
+            vertices.append(ring_vertices)
+            codes.append(ring_codes)
+    return Path(np.concatenate(vertices), np.concatenate(codes))
+
+
+def map_figure(size, facecolor):
+    """
+    make a figure with the section map axes, nothing drawn on it yet
+    """
+    fig = plt.Figure(figsize=(size[0] / 100.0, size[1] / 100.0), dpi=100, facecolor=facecolor)
+    ax = fig.add_axes([0, 0, 1, 1], projection=ccrs.PlateCarree())
+    ax.set_extent(MAP_EXTENT, ccrs.Geodetic())
+    return fig, ax
+
+
+def render_figure(fig):
+    """
+    draw a figure, return its pixels as a height x width x 4 RGBA array
+    """
+    canvas = agg.FigureCanvasAgg(fig)
+    canvas.draw()
+    return np.array(canvas.buffer_rgba())
 
-    projection = ccrs.PlateCarree()
-    ax = fig.add_axes([0, 0, 1, 1], projection=projection)
-    ax.set_extent([-168, -52, 10, 60], ccrs.Geodetic())
+
+def read_section_shapes():
+    """
+    return the section names and their shapes as matplotlib paths, in CONTEST_SECTIONS order
+    """
+    section_names = []
+    paths = []
+    for section_name in CONTEST_SECTIONS.keys():
+        shape_file_name = 'shapes/{}.shp'.format(section_name)
+        geometry = next(shapereader.Reader(shape_file_name).geometries(), None)
+        if geometry is None:
+            logging.warning('no shape for section %s', section_name)
+            continue
+        section_names.append(section_name)
+        paths.append(geometry_to_path(geometry))
+    return section_names, paths
+
+
+def render_section_raster(size):
+    """
+    rasterize the map at size.  returns a dict of arrays:
+    background is the map without the sections.
+    mask has the index + 1 of the section (in section_names) covering each pixel, 0 where there is none.
+    edges is the alpha of the white section borders.
+    longitudes and latitudes are those of each pixel column and row, NaN off the map.
+    """
+    logging.info('rendering %d x %d section map', size[0], size[1])
+    fig, ax = map_figure(size, 'black')
     ax.add_feature(cfeature.OCEAN, color='#000080')
     ax.add_feature(cfeature.LAKES, color='#000080')
     ax.add_feature(cfeature.LAND, color='#113311')
-
     ax.coastlines('50m')
-
-    ranges = [0, 1, 10, 20, 50, 100, 200]  # , 500]  # , 1000]
-    num_colors = len(ranges)
-    color_palette = matplotlib.cm.viridis(np.linspace(0.33, 1, num_colors + 1))
-
+    background = render_figure(fig)[:, :, :3]
+
+    # the map is PlateCarree, so longitude only depends on the column and latitude only on the row.
+    to_lon_lat = ax.transData.inverted()
+    columns = np.arange(size[0]) + 0.5
+    rows = np.arange(size[1]) + 0.5
+    longitudes = to_lon_lat.transform(np.column_stack([columns, np.full(size[0], size[1] / 2.0)]))[:, 0]
+    latitudes = to_lon_lat.transform(np.column_stack([np.full(size[1], size[0] / 2.0), size[1] - rows]))[:, 1]
+    lon_min, lon_max, lat_min, lat_max = ax.get_extent(ccrs.PlateCarree())
+    longitudes[(longitudes < lon_min) | (longitudes > lon_max)] = np.nan
+    latitudes[(latitudes < lat_min) | (latitudes > lat_max)] = np.nan
+
+    # each section is filled with its number in the red channel, without antialiasing so every pixel is exact.
+    section_names, paths = read_section_shapes()
+    fig, ax = map_figure(size, 'none')
+    ax.patch.set_visible(False)
+    ax.spines['geo'].set_visible(False)
+    codes = [(i / 255.0, 0, 0, 1) for i in range(1, len(paths) + 1)]
+    ax.add_collection(PathCollection(paths, transform=ax.transData, facecolors=codes, linewidths=0,
+                                     antialiaseds=False))
+    pixels = render_figure(fig)
+    mask = np.where(pixels[:, :, 3] == 255, pixels[:, :, 0], 0).astype(np.uint8)
+
+    fig, ax = map_figure(size, 'none')
+    ax.patch.set_visible(False)
+    ax.spines['geo'].set_visible(False)
+    ax.add_collection(PathCollection(paths, transform=ax.transData, facecolors='none', linewidths=0.7,
+                                     edgecolors='w'))
+    edges = render_figure(fig)[:, :, 3].copy()
+    return {'background': background, 'mask': mask, 'edges': edges, 'section_names': np.array(section_names),
+            'longitudes': longitudes, 'latitudes': latitudes}
+
+
+def section_raster_key(size):
+    """
+    return a hash of everything the section raster depends on: the size, the extent, and the shape files.
+    """
+    digest = hashlib.sha1()
+    digest.update(repr((MAP_RASTER_VERSION, tuple(size), MAP_EXTENT, list(CONTEST_SECTIONS.keys()))).encode())
     for section_name in CONTEST_SECTIONS.keys():
-        qsos = qsos_by_section.get(section_name)
-        if qsos is None:
-            qsos = 0
-            #logging.debug('section {} has no qsos!'.format(section_name))
+        for extension in ('shp', 'shx'):
+            try:
+                with open('shapes/{}.{}'.format(section_name, extension), 'rb') as f:
+                    digest.update(f.read())
+            except OSError:
+                digest.update(b'missing')
+    return digest.hexdigest()[:16]
 
-        shape_file_name = 'shapes/{}.shp'.format(section_name)
-        reader = shapereader.Reader(shape_file_name)
-        shapes = reader.records()
-        shape = next(shapes)
-        if shape is not None:
-            color_index = 0
-            for range_max in ranges:
-                if range_max == -1 or qsos <= range_max:
-                    break
-                color_index += 1
-                if color_index == num_colors:
-                    break
-
-            shape.attributes['name'] = section_name
-            section_color = 'k' if color_index == 0 else color_palette[color_index]
-            ax.add_geometries([shape.geometry], projection, linewidth=0.7, edgecolor="w", facecolor=section_color)
 
-    canvas = agg.FigureCanvasAgg(fig)
-    canvas.draw()
-    renderer = canvas.get_renderer()
-    raw_data = renderer.tostring_rgb()
+def load_section_raster(size, rebuild=False):
+    """
+    return the section raster arrays for size (see render_section_raster), from the map cache if it has them,
+    otherwise render them and save them in the cache.
+    """
+    file_name = os.path.join(MAP_CACHE_DIR, 'sections_{}x{}_{}.npz'.format(size[0], size[1],
+                                                                          section_raster_key(size)))
+    if not rebuild and os.path.exists(file_name):
+        try:
+            with np.load(file_name) as cached:
+                logging.debug('read section map %s', file_name)
+                return {name: cached[name] for name in cached.files}
+        except (OSError, ValueError, KeyError) as e:
+            logging.warning('cannot read section map %s: %s', file_name, e)
+
+    raster = render_section_raster(size)
+    try:
+        os.makedirs(MAP_CACHE_DIR, exist_ok=True)
+        temp_file_name = file_name + '.tmp.npz'
+        np.savez_compressed(temp_file_name, **raster)
+        os.replace(temp_file_name, file_name)
+        logging.info('saved section map %s', file_name)
+    except OSError as e:
+        logging.warning('cannot save section map %s: %s', file_name, e)
+    return raster
+
+
+def sun_position(when):
+    """
+    return the sun's declination and the longitude it is overhead at, in degrees, at unix time when.
+    good to about a tenth of a degree, plenty for a gray line.
+    """
+    days = when / 86400.0 - 10957.5  # since 2000-01-01 12:00 UTC
+    mean_longitude = 280.460 + 0.9856474 * days
+    mean_anomaly = np.radians(357.528 + 0.9856003 * days)
+    ecliptic_longitude = np.radians(mean_longitude + 1.915 * np.sin(mean_anomaly) + 0.020 * np.sin(2 * mean_anomaly))
+    obliquity = np.radians(23.439 - 0.0000004 * days)
+    declination = np.degrees(np.arcsin(np.sin(obliquity) * np.sin(ecliptic_longitude)))
+    right_ascension = np.degrees(np.arctan2(np.cos(obliquity) * np.sin(ecliptic_longitude),
+                                            np.cos(ecliptic_longitude)))
+    sidereal_degrees = 280.46061837 + 360.98564736629 * days
+    subsolar_longitude = (right_ascension - sidereal_degrees + 180.0) % 360.0 - 180.0
+    return declination, subsolar_longitude
+
+
+class SectionMap:
+    """
+    the sections worked map, for one display size.
+    the map is rasterized once, ahead of time by prerender_map.py or on first use, and cached in MAP_CACHE_DIR.
+    the sections are colored from a palette and their borders blended over them only when the counts change.
+    every draw shades the night side of that, and marks the QTH.
+    """
 
-    fig.clf()
-    plt.close(fig)
-    canvas_size = canvas.get_width_height()
+    ranges = [0, 1, 10, 20, 50, 100, 200]  # , 500]  # , 1000]
+
+    def __init__(self, size):
+        logging.debug('SectionMap(%d x %d)', size[0], size[1])
+        self.size = size
+        palette = matplotlib.cm.viridis(np.linspace(0.33, 1, len(self.ranges) + 1))
+        palette[0] = matplotlib.colors.to_rgba('k')
+        self.color_palette = np.round(palette[:, :3] * 255).astype(np.uint8)
+
+        raster = load_section_raster(size)
+        mask = raster['mask']
+        self.section_names = list(raster['section_names'])
+        self.height, self.width = mask.shape
+        # the background has black where the sections go, so the section colors can just be or-ed in.
+        self.mask = mask.ravel()
+        self.background = np.where(mask[:, :, np.newaxis] > 0, 0, raster['background']).reshape(-1, 3)
+        self.background = self.background.astype(np.uint8)
+        edges = raster['edges'].ravel()
+        self.edge_pixels = np.flatnonzero(edges)
+        self.edge_alpha = edges[self.edge_pixels].astype(np.uint16)[:, np.newaxis]
+        self.edge_white = 255 * self.edge_alpha
+        self.sections_image = None
+        self.drawn_colors = None
+
+        # the night shading is worked out on the map's pixels only, as the outer product of rows and columns.
+        longitudes = raster['longitudes']
+        latitudes = raster['latitudes']
+        columns = np.flatnonzero(~np.isnan(longitudes))
+        rows = np.flatnonzero(~np.isnan(latitudes))
+        self.map_area = (slice(rows[0], rows[-1] + 1), slice(columns[0], columns[-1] + 1))
+        self.longitudes = np.radians(longitudes[columns]).astype(np.float32)
+        latitudes = np.radians(latitudes[rows]).astype(np.float32)
+        self.sin_latitudes = np.sin(latitudes)[:, np.newaxis]
+        self.cos_latitudes = np.cos(latitudes)[:, np.newaxis]
+        self.sin_elevation = np.empty((len(rows), len(columns)), dtype=np.float32)
+        self.shaded = np.empty((len(rows), len(columns) * 3), dtype=np.uint16)
+        self.qth_marker = self.make_qth_marker(raster['longitudes'], raster['latitudes'])
+
+    def make_qth_marker(self, longitudes, latitudes):
+        """
+        return the pixels of the QTH marker, as (flat indexes, colors), a white ringed red dot.
+        """
+        column = np.nanargmin(np.abs(longitudes - QTH_LONGITUDE))
+        row = np.nanargmin(np.abs(latitudes - QTH_LATITUDE))
+        if abs(longitudes[column] - QTH_LONGITUDE) > 1 or abs(latitudes[row] - QTH_LATITUDE) > 1:
+            logging.warning('QTH %f, %f is not on the map', QTH_LATITUDE, QTH_LONGITUDE)
+            return np.zeros(0, dtype=np.intp), np.zeros((0, 3), dtype=np.uint8)
+        radius = max(3, self.width // 320)
+        y, x = np.mgrid[-radius - 1:radius + 2, -radius - 1:radius + 2]
+        distance = np.hypot(x, y)
+        inside = (distance <= radius + 1) & (row + y >= 0) & (row + y < self.height) & \
+                 (column + x >= 0) & (column + x < self.width)
+        pixels = (row + y[inside]) * self.width + column + x[inside]
+        colors = np.where((distance[inside] <= radius - 1)[:, np.newaxis], np.array(RED)[:3], np.array(WHITE)[:3])
+        return pixels, colors.astype(np.uint8)
+
+    def section_colors(self, qsos_by_section):
+        """
+        return the RGB color of each section for its QSO count
+        """
+        qsos = np.array([qsos_by_section.get(section_name, 0) for section_name in self.section_names])
+        return self.color_palette[np.searchsorted(self.ranges, qsos)]
+
+    def draw_sections(self, colors):
+        """
+        color the sections and blend their borders over them
+        """
+        palette = np.zeros((256, 3), dtype=np.uint8)
+        palette[1:len(self.section_names) + 1] = colors
+        image = np.take(palette, self.mask, axis=0)
+        np.bitwise_or(image, self.background, out=image)
+        edges = image[self.edge_pixels]
+        image[self.edge_pixels] = (edges * (255 - self.edge_alpha) + self.edge_white) // 255
+        return image.reshape(self.height, self.width, 3)
+
+    def night_shade(self, when):
+        """
+        return how much to keep of each map pixel's red, green and blue, 256 is all, in full day,
+        down to 256 - NIGHT_SHADE in full night.  the sun's elevation is worked out for every pixel,
+        twilight fades from the horizon to TWILIGHT_DEGREES below.
+        """
+        declination, subsolar_longitude = np.radians(sun_position(when))
+        sin_elevation = self.sin_elevation
+        np.multiply(self.cos_latitudes * np.float32(np.cos(declination)),
+                    np.cos(self.longitudes - np.float32(subsolar_longitude)), out=sin_elevation)
+        np.add(sin_elevation, self.sin_latitudes * np.float32(np.sin(declination)), out=sin_elevation)
+        # darkness, from 0 at sunset to NIGHT_SHADE at the end of twilight
+        np.multiply(sin_elevation, np.float32(-NIGHT_SHADE / np.sin(np.radians(TWILIGHT_DEGREES))), out=sin_elevation)
+        np.clip(sin_elevation, 0, NIGHT_SHADE, out=sin_elevation)
+        keep = 256 - sin_elevation.astype(np.uint16)
+        return np.repeat(keep, 3, axis=1)  # the same for red, green and blue
+
+    def draw(self, qsos_by_section, when=None):
+        """
+        draw the map at unix time when, now if None, return the RGB image data and its size
+        """
+        colors = self.section_colors(qsos_by_section)
+        if self.drawn_colors is None or not np.array_equal(colors, self.drawn_colors):
+            self.sections_image = self.draw_sections(colors)
+            self.drawn_colors = colors
+        image = self.sections_image.copy()
+        map_area = image[self.map_area]
+        map_area = map_area.reshape(map_area.shape[0], -1)  # a view, each row of the map is contiguous
+        np.multiply(map_area, self.night_shade(time.time() if when is None else when), out=self.shaded)
+        np.right_shift(self.shaded, 8, out=self.shaded)
+        np.copyto(map_area, self.shaded, casting='unsafe')
+        pixels, marker_colors = self.qth_marker
+        image.reshape(-1, 3)[pixels] = marker_colors
+        return image.tobytes(), (self.width, self.height)
+
+
+@chart_inputs('qsos_by_section', every=GRAY_LINE_SECONDS)
+def draw_map(size, qsos_by_section, when=None):
+    """
+    make the choropleth with Cartopy & section shapefiles, with the gray line at unix time when, now if None.
+    a SectionMap for the size is made once and kept, in each process that draws the map.
+    """
+    global _map
+    logging.debug('draw_section map()')
+    if _map is None or _map.size != size:
+        _map = SectionMap(size)
+    raw_data, canvas_size = _map.draw(qsos_by_section, when)
     logging.debug('draw_map() done')
     return raw_data, canvas_size
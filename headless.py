@@ -5,13 +5,13 @@ create images from contest data
 non-interactive version.  This creates files on the disk and updates them periodically.
 """
 
-import gc
 import logging
 import os
 import re
 import sqlite3
 import time
 
+import chartengine
 import config
 import dataaccess
 import graphics
@@ -29,53 +29,31 @@ def makePNGTitle(image_dir, title):
     return ''.join([image_dir, '/', re.sub('[^\w\-_]', '_', title), '.png'])
 
 
-def create_images(size, image_dir, base_map, last_qso_timestamp):
+def create_images(size, image_dir, engine, last_snapshot):
     """
-    load data from the database tables
+    load data from the database tables, and save the charts that changed, drawn by engine, as image files
+    returns the statistics snapshot the images were made from.
     """
     logging.debug('load data')
 
-    qso_operators = []
-    qso_stations = []
-    qso_band_modes = []
-    operator_qso_rates = []
-    qsos_per_hour = []
-    qsos_by_section = {}
-
+    snapshot = last_snapshot
     db = None
     data_updated = False
 
     try:
         logging.debug('connecting to database')
-        db = sqlite3.connect(config.DATABASE_FILENAME)
-        cursor = db.cursor()
+        db = dataaccess.open_database(read_only=True)
         logging.debug('database connected')
 
-        # get timestamp from the last record in the database
-        last_qso_time, message = dataaccess.get_last_qso(cursor)
-
-        logging.debug('old_timestamp = %d, timestamp = %d', last_qso_timestamp, last_qso_time)
-        if last_qso_time != last_qso_timestamp:
+        # only read the statistics if the log has changed since the last snapshot.
+        version = dataaccess.get_qso_log_version(db.cursor())
+        logging.debug('old version = %s, version = %d',
+                      None if last_snapshot is None else last_snapshot.version, version)
+        if last_snapshot is None or version != last_snapshot.version:
             logging.debug('data updated!')
             data_updated = True
-
-            # load qso_operators
-            qso_operators = dataaccess.get_operators_by_qsos(cursor)
-
-            # load qso_stations -- maybe useless chartjunk
-            qso_stations = dataaccess.get_station_qsos(cursor)
-
-            # get something else.
-            qso_band_modes = dataaccess.get_qso_band_modes(cursor)
-
-            # load QSOs per Hour by Operator
-            operator_qso_rates = dataaccess.get_qsos_per_hour_per_operator(cursor, last_qso_time)
-
-            # load QSO rates per Hour by Band
-            qsos_per_hour, qsos_per_band = dataaccess.get_qsos_per_hour_per_band(cursor)
-
-            # load QSOs by Section
-            qsos_by_section = dataaccess.get_qsos_by_section(cursor)
+            # read all the statistics at once, so the charts agree with each other.
+            snapshot = dataaccess.get_stats_snapshot(db)
 
         logging.debug('load data done')
     except sqlite3.OperationalError as error:
@@ -84,76 +62,21 @@ def create_images(size, image_dir, base_map, last_qso_timestamp):
     finally:
         if db is not None:
             logging.debug('Closing DB')
-            cursor.close()
             db.close()
             db = None
 
-    if data_updated:
-        try:
-            image_data, image_size = graphics.qso_summary_table(size, qso_band_modes)
-            filename = makePNGTitle(image_dir, 'qso_summary_table')
-            graphics.save_image(image_data, image_size, filename)
-        except Exception as e:
-            logging.exception(e)
-        try:
-            image_data, image_size = graphics.qso_rates_table(size, operator_qso_rates)
-            filename = makePNGTitle(image_dir, 'qso_rates_table')
-            graphics.save_image(image_data, image_size, filename)
-        except Exception as e:
-            logging.exception(e)
-        try:
-            image_data, image_size = graphics.qso_operators_graph(size, qso_operators)
-            filename = makePNGTitle(image_dir, 'qso_operators_graph')
-            graphics.save_image(image_data, image_size, filename)
-        except Exception as e:
-            logging.exception(e)
-        try:
-            image_data, image_size = graphics.qso_operators_table(size, qso_operators)
-            filename = makePNGTitle(image_dir, 'qso_operators_table')
-            graphics.save_image(image_data, image_size, filename)
-        except Exception as e:
-            logging.exception(e)
-        try:
-            image_data, image_size = graphics.qso_stations_graph(size, qso_stations)
-            filename = makePNGTitle(image_dir, 'qso_stations_graph')
-            graphics.save_image(image_data, image_size, filename)
-        except Exception as e:
-            logging.exception(e)
-        try:
-            image_data, image_size = graphics.qso_bands_graph(size, qso_band_modes)
-            filename = makePNGTitle(image_dir, 'qso_bands_graph')
-            graphics.save_image(image_data, image_size, filename)
-        except Exception as e:
-            logging.exception(e)
-        try:
-            image_data, image_size = graphics.qso_modes_graph(size, qso_band_modes)
-            filename = makePNGTitle(image_dir, 'qso_modes_graph')
-            graphics.save_image(image_data, image_size, filename)
-        except Exception as e:
-            logging.exception(e)
-        try:
-            image_data, image_size = graphics.qso_rates_chart(size, qsos_per_hour)
-            filename = makePNGTitle(image_dir, 'qso_rates_chart')
-            graphics.save_image(image_data, image_size, filename)
-        except Exception as e:
-            logging.exception(e)
-
-    # map gets updated every time so grey line moves
-    try:
-        # There is a memory leak in the next code -- is there?
-        image_data, image_size = graphics.draw_map(size, qsos_by_section, base_map)
-        filename = makePNGTitle(image_dir, 'sections_worked_map')
-        graphics.save_image(image_data, image_size, filename)
-        gc.collect()
+    def save_chart(name, image_data, image_size):
+        if image_data is not None:
+            graphics.save_image(image_data, image_size, makePNGTitle(image_dir, name))
 
-    except Exception as e:
-        logging.exception(e)
+    # the engine only draws the charts whose data changed, and the map when the grey line moves.
+    engine.draw(list(chartengine.CHARTS.keys()), size, snapshot, save_chart)
 
     if data_updated:
         if config.POST_FILE_COMMAND is not None:
             os.system(config.POST_FILE_COMMAND)
 
-    return last_qso_time
+    return snapshot
 
 
 def main():
@@ -161,20 +84,21 @@ def main():
     size = (1280, 1024)
     image_dir = '.'
 
-    logging.info('creating world...')
-    base_map = graphics.create_map()
+    engine = chartengine.ChartEngine()
 
     run = True
-    last_qso_timestamp = ''
+    snapshot = None
     logging.info('headless running...')
     while run:
         try:
-            create_images(size, image_dir, base_map, last_qso_timestamp)
+            snapshot = create_images(size, image_dir, engine, snapshot)
             time.sleep(config.DATA_DWELL_TIME)
         except KeyboardInterrupt:
             logging.info('Keyboard interrupt, shutting down...')
             run = False
 
+    engine.shutdown()
+    engine.log_counts()
     logging.info('headless shutdown...')
 
 
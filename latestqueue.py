@@ -0,0 +1,81 @@
+# n1mm_view latest value queue
+# carries messages between processes, keeping only the newest message for each key.
+
+import collections
+import logging
+import multiprocessing
+import queue
+
+__author__ = 'Jeffrey B. Otterson, N1KDO'
+__copyright__ = 'Copyright 2016, 2017, 2019 Jeffrey B. Otterson'
+__license__ = 'Simplified BSD'
+
+
+class LatestQueue:
+    """
+    a bounded multiprocessing queue of messages, where a newer message replaces an older one with the same key.
+    key(message) returns the key of a message, and must be a module level function so it can be pickled.
+    there is never more than one message for a key in the queue.  the sender holds a newer one until the
+    receiver has read it, and a newer message with the same key replaces a held one, so a message that has
+    been replaced is never sent.  one sending process and one receiving process only.
+    """
+
+    def __init__(self, key, maxsize):
+        self.key = key
+        self.maxsize = maxsize
+        self.queue = multiprocessing.Queue(maxsize)
+        self.received = multiprocessing.Value('q', 0)  # messages the receiver has read
+        self.sent = 0
+        self.in_flight = {}  # key: number of the message with that key sent and maybe not yet read
+        self.held = collections.OrderedDict()  # key: message waiting to be sent
+        self.coalesced = collections.Counter()  # key: messages dropped because a newer one replaced them
+
+    def put(self, message):
+        """
+        send message, or hold it until it can be sent.  returns the number of messages still held.
+        """
+        key = self.key(message)
+        if key in self.held:
+            self.coalesced[key] += 1
+            del self.held[key]
+        self.held[key] = message
+        return self.flush()
+
+    def flush(self):
+        """
+        send the held messages, oldest first, whose key has no message in the queue, while there is room.
+        returns the number of messages still held.
+        """
+        received = self.received.value
+        self.in_flight = {key: number for key, number in self.in_flight.items() if number > received}
+        for key in [key for key in self.held if key not in self.in_flight]:
+            try:
+                self.queue.put_nowait(self.held[key])
+            except queue.Full:
+                break
+            self.sent += 1
+            self.in_flight[key] = self.sent
+            del self.held[key]
+        return len(self.held)
+
+    def get_latest(self):
+        """
+        return the messages waiting in the queue, oldest first.
+        reads at most maxsize messages, so a busy sender cannot keep the receiver here.
+        """
+        messages = []
+        for _ in range(self.maxsize):
+            try:
+                messages.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+            with self.received.get_lock():
+                self.received.value += 1
+        return messages
+
+    def log_counts(self, who):
+        if self.coalesced:
+            logging.info('%s coalesced messages: %s', who, ', '.join('%s %d' % (key, count) for key, count
+                                                                     in sorted(self.coalesced.items())))
+        else:
+            logging.info('%s coalesced no messages', who)
@@ -35,42 +35,14 @@ def main():
 
     logging.debug('display setup')
 
-    qso_operators = []
-    qso_stations = []
-    qso_band_modes = []
-    operator_qso_rates = []
-    qsos_per_hour = []
-    qsos_by_section = {}
-
     logging.debug('load data')
     db = None
-    cursor = None
     try:
         logging.debug('connecting to database')
-        db = sqlite3.connect(config.DATABASE_FILENAME)
-        cursor = db.cursor()
+        db = dataaccess.open_database(read_only=True)
         logging.debug('database connected')
 
-        # get timestamp from the last record in the database
-        last_qso_time, message = dataaccess.get_last_qso(cursor)
-
-        # load qso_operators
-        qso_operators = dataaccess.get_operators_by_qsos(cursor)
-
-        # load qso_stations -- maybe useless chartjunk
-        qso_stations = dataaccess.get_station_qsos(cursor)
-
-        # get something else.
-        qso_band_modes = dataaccess.get_qso_band_modes(cursor)
-
-        # load QSOs per Hour by Operator
-        operator_qso_rates = dataaccess.get_qsos_per_hour_per_operator(cursor, last_qso_time)
-
-        # load QSO rates per Hour by Band
-        qsos_per_hour, qsos_per_band = dataaccess.get_qsos_per_hour_per_band(cursor)
-
-        # load QSOs by Section
-        qsos_by_section = dataaccess.get_qsos_by_section(cursor)
+        snapshot = dataaccess.get_stats_snapshot(db)
 
         logging.debug('load data done')
     except sqlite3.OperationalError as error:
@@ -79,20 +51,19 @@ def main():
     finally:
         if db is not None:
             logging.debug('Closing DB')
-            cursor.close()
             db.close()
             db = None
 
     try:
-        # image_data, image_size = graphics.qso_summary_table(size, qso_band_modes)
-        # image_data, image_size = graphics.qso_rates_table(size, operator_qso_rates)
-        # image_data, image_size = graphics.qso_operators_graph(size, qso_operators)
-        # image_data, image_size = graphics.qso_operators_table(size, qso_operators)
-        # image_data, image_size = graphics.qso_stations_graph(size, qso_stations)
-        # image_data, image_size = graphics.qso_bands_graph(size, qso_band_modes)
-        # image_data, image_size = graphics.qso_modes_graph(size, qso_band_modes)
-        # image_data, image_size = graphics.qso_rates_chart(size, qsos_per_hour)
-        image_data, image_size = graphics.draw_map(size, qsos_by_section)
+        # image_data, image_size = graphics.qso_summary_table(size, snapshot.qso_band_modes)
+        # image_data, image_size = graphics.qso_rates_table(size, snapshot.operator_qso_rates)
+        # image_data, image_size = graphics.qso_operators_graph(size, snapshot.qso_operators)
+        # image_data, image_size = graphics.qso_operators_table(size, snapshot.qso_operators)
+        # image_data, image_size = graphics.qso_stations_graph(size, snapshot.qso_stations)
+        # image_data, image_size = graphics.qso_bands_graph(size, snapshot.qso_band_modes)
+        # image_data, image_size = graphics.qso_modes_graph(size, snapshot.qso_band_modes)
+        # image_data, image_size = graphics.qso_rates_chart(size, snapshot.qsos_per_hour)
+        image_data, image_size = graphics.draw_map(size, snapshot.qsos_by_section)
         #  gc.collect()
 
         image = pygame.image.frombuffer(image_data, image_size, 'RGB')
@@ -0,0 +1,58 @@
+#!/usr/bin/python3
+"""
+n1mm_view section map pre-renderer
+rasterizes the sections map ahead of time, so the dashboard and headless do not
+have to on their first draw.  the maps are saved in MAP_CACHE_DIR, one per size,
+and are made again when the shape files change.
+"""
+
+import argparse
+import logging
+import os
+import time
+
+from config import *
+
+__author__ = 'Jeffrey B. Otterson, N1KDO'
+__copyright__ = 'Copyright 2016, 2017, 2019 Jeffrey B. Otterson'
+__license__ = 'Simplified BSD'
+
+logging.basicConfig(format='%(asctime)s.%(msecs)03d %(levelname)-8s %(message)s', datefmt='%Y-%m-%d %H:%M:%S',
+                    level=LOG_LEVEL)
+logging.Formatter.converter = time.gmtime
+
+
+def parse_size(text):
+    try:
+        width, height = text.lower().split('x')
+        return int(width), int(height)
+    except ValueError:
+        raise argparse.ArgumentTypeError('size must be WIDTHxHEIGHT, not %s' % text)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='pre-render the sections map')
+    parser.add_argument('sizes', nargs='*', type=parse_size, default=[],
+                        help='map sizes as WIDTHxHEIGHT, headless draws its map at 1280x1024')
+    parser.add_argument('--dashboard', action='append', type=parse_size, default=[], metavar='WIDTHxHEIGHT',
+                        help='screen size the dashboard runs on, may be repeated.  with no sizes, the default is '
+                             '%dx%d' % (IMAGE_WIDTH, IMAGE_HEIGHT))
+    parser.add_argument('--force', action='store_true', help='render the maps even if they are already cached')
+    args = parser.parse_args()
+    if not args.sizes and not args.dashboard:
+        args.dashboard = [(IMAGE_WIDTH, IMAGE_HEIGHT)]
+
+    # graphics needs pygame for its fonts, but not a display.
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    import graphics
+
+    # the dashboard draws its charts above the crawl line.
+    sizes = [(width, height - graphics.view_font_height) for width, height in args.dashboard] + args.sizes
+    for size in sizes:
+        t0 = time.time()
+        graphics.load_section_raster(size, rebuild=args.force)
+        logging.info('%d x %d section map ready in %.1f seconds', size[0], size[1], time.time() - t0)
+
+
+if __name__ == '__main__':
+    main()
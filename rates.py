@@ -0,0 +1,80 @@
+# n1mm_view QSO rate engine
+
+import logging
+import time
+
+import config
+
+__author__ = 'Jeffrey B. Otterson, N1KDO'
+__copyright__ = 'Copyright 2016, 2017, 2019 Jeffrey B. Otterson'
+__license__ = 'Simplified BSD'
+
+
+class RateEngine:
+    """
+    QSO rates over several sliding windows, for any number of keys.
+    each key has a ring buffer of per-minute QSO counts covering the longest window.
+    the newest slot is the current minute by the wall clock, so rates fall when QSOs stop.
+    """
+
+    def __init__(self, windows=None):
+        self.windows = list(config.RATE_WINDOW_MINUTES if windows is None else windows)
+        self.minutes = max(self.windows)
+        self.counts = {}
+        self.current_minute = int(time.time()) // 60
+
+    def advance(self, now=None):
+        """
+        move the newest slot up to the minute of now, emptying the slots that fall out of the windows.
+        """
+        minute = int(time.time() if now is None else now) // 60
+        elapsed = minute - self.current_minute
+        if elapsed <= 0:
+            return
+        for ring in self.counts.values():
+            if elapsed >= self.minutes:
+                ring[:] = [0] * self.minutes
+            else:
+                for m in range(self.current_minute + 1, minute + 1):
+                    ring[m % self.minutes] = 0
+        self.current_minute = minute
+
+    def add(self, key, timestamp, change=1):
+        """
+        count change QSOs for key at timestamp.  QSOs older than the longest window are ignored.
+        only the wall clock moves the newest slot.  a QSO up to a minute ahead of it is counted in the newest
+        minute, one further ahead is from a clock that is wrong, and is ignored.
+        """
+        minute = timestamp // 60
+        if minute > self.current_minute:
+            self.advance()
+        if minute > self.current_minute:
+            if minute - self.current_minute > 1:
+                logging.debug('ignoring QSO %d minutes in the future', minute - self.current_minute)
+                return
+            minute = self.current_minute
+        if self.current_minute - minute >= self.minutes:
+            return
+        ring = self.counts.get(key)
+        if ring is None:
+            ring = [0] * self.minutes
+            self.counts[key] = ring
+        ring[minute % self.minutes] += change
+
+    def rates(self, key):
+        """
+        return the QSOs per hour for key over each window, newest minute included.
+        """
+        ring = self.counts.get(key)
+        if ring is None:
+            return [0] * len(self.windows)
+        result = []
+        for window in self.windows:
+            total = 0
+            for m in range(self.current_minute - window + 1, self.current_minute + 1):
+                total += ring[m % self.minutes]
+            result.append(total * 60 // window)
+        return result
+
+    def keys(self):
+        return self.counts.keys()